@@ -4,7 +4,76 @@
 # In[ ]:
 
 
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
 import random
+import math
+import signal
+import struct
+import sys
+import time
+import urllib.parse
+from collections import OrderedDict, namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is only needed for the batch evaluator, everything else runs without it
+    np = None
+
+try:
+    import resource
+except ImportError:
+    # Peak memory in the batch report is only available where the resource module exists
+    resource = None
+
+try:
+    import sqlite3
+except ImportError:
+    # The solution store is the only thing that needs SQLite, Python builds without it can still solve puzzles
+    sqlite3 = None
+
+# Solutions stored by an older version of the solver are thrown away. Bump this whenever a change to how lasers are
+# traced or to the .bff rules could change what counts as a solution
+ENGINE_VERSION = '1'
+
+# The solver modes of final_solution_generator
+SOLVER_MODES = ['random', 'exhaustive', 'backtrack', 'batch', 'anneal']
+
+# How often (in seconds) a solver service worker checks whether the solve it is running is still wanted, and how many
+# solves the service can ask to stop early at once (any further ones only stop at the timeout of the service)
+STOP_INTERVAL = 0.05
+STOP_SLOTS = 1024
+
+# The layout of a puzzle catalogue (see Catalogue): a header with the format version and the number of puzzles, the
+# offset of every record, then the records. A record is a fixed size header (width, height, counts of A, B and C blocks,
+# number of lasers and targets, length of the name) followed by the grid with one byte per spot, a fixed size field per
+# laser (x, y, vx, vy) and per target (x, y), and the name of the .bff file the puzzle came from
+CATALOGUE_EXTENSION = '.lzc'
+CATALOGUE_MAGIC = b'LAZORCAT'
+CATALOGUE_VERSION = 1
+CATALOGUE_HEADER = struct.Struct('<8sII')
+CATALOGUE_OFFSET = struct.Struct('<Q')
+CATALOGUE_RECORD = struct.Struct('<BBHHHHHH')
+CATALOGUE_LASER = struct.Struct('<hhbb')
+CATALOGUE_TARGET = struct.Struct('<hh')
+
+
+# Integer codes for the blocks on the compact mesh used while tracing lasers. Open spots and 'x' spots look the same
+# to a laser, UNDECIDED marks a spot a solver has not filled yet and OUTSIDE pads the mesh so beams can never index off it
+EMPTY, REFLECT, OPAQUE, REFRACT, UNDECIDED, OUTSIDE = range(6)
+BLOCK_CODES = {'o': EMPTY, 'x': EMPTY, 'A': REFLECT, 'B': OPAQUE, 'C': REFRACT, '?': UNDECIDED}
+
+# The (reflect, transmit) properties of each block code, looked up instead of building a Blocks object every step
+# Undecided spots and the padding around the mesh let a laser through like an empty spot
+BLOCK_PROPERTIES = ((False, True), (True, False), (False, False), (True, True), (False, True), (False, True))
 
 class Game:
 
@@ -22,8 +91,27 @@ class Game:
             file : *str* 
                 The name of file containing laser puzzle information for each level.
         '''
-        self.fptr = open(file, 'r').read()
+        self.name = file
+        with open(file, 'r') as handle:
+            self.fptr = handle.read()
 
+    @classmethod
+    def from_text(cls, text):
+
+        '''
+        This function makes a game from the contents of a .bff file instead of its name, for puzzles that never were a
+        file (sent to the solver service, for example).
+        **Parameters**
+            text : *str*
+                The puzzle in the .bff format.
+        **Returns**
+            game: *Game*
+                The game, ready for database().
+        '''
+        game = cls.__new__(cls)
+        game.name = '<text>'
+        game.fptr = text
+        return game
 
     def database(self):
 
@@ -41,104 +129,11 @@ class Game:
                 List of tuples containing the position of the targets.
             blocks : *dict* 
                 A dictionary with the types of blocks as keys and the number of blocks as values.
+        These are set on the game rather than returned. A file that breaks the .bff format raises a PuzzleFormatError
+        naming the line at fault.
         '''
-        # Setting up the empty set to establish the raw data taken from the activated file
-        all_input_data = self.fptr.split('\n')
-        raw_data = []
-            
-        for line in all_input_data:
-            if '#' not in line and line != '':
-                raw_data.append(line)
-        
-        # Needing to set the two variables for the grid start and stop locations to avoid any variable issues
-        grid_start = None
-        grid_stop = None
-
-        # Searching through the dataset and taking the current position and setting our variable to this value
-        # This allows us to itterate through the data between these two points in the future to collect our grid
-        for i, line in enumerate(raw_data):
-            if line == 'GRID START':
-                grid_start = i
-            elif line == 'GRID STOP':
-                grid_stop = i
-            if grid_start is not None and grid_stop is not None:
-                break
-
-        # Grid raw being set to the previously set range for grid start and grid stop
-        grid_raw = raw_data[grid_start+1:grid_stop]
+        self.grid, self.laser_start, self.laser_path, self.targets, self.blocks = parse_bff(self.fptr, self.name)
 
-        self.grid = []
-        
-        
-        # Appending this data information to the grid within the class and removing the unnecessary information if added
-        # We ignore ' ' characters to make sure that the final grid is only the map of the puzzle
-        for row in grid_raw:
-            row_list = [char for char in list(row.strip()) if char != ' '] 
-            self.grid.append(row_list)
-
-        for line in reversed(grid_raw):
-            if line in raw_data:
-                raw_data.remove(line)
-
-        # Establishing the origin and the direction of the laser to be used in future locations
-        # We need this data to be able to solve the puzzles
-        self.laser_start=[]
-        self.laser_path=[]
-
-        # Extracting the data and appending the tuple to our empty set
-        # We search for the section of the .bff that includes information about laser 'L'
-        # Depending on the length, we can know if it's the origin or the direction
-        for line in raw_data:
-            laser_direction = []
-            laser_origin = []
-            if 'L' in line:
-                line = line.lstrip("L").split()
-                if len(line) == 4 :
-                    for i in range(len(line)):
-                        if i < 2 :
-                            laser_origin.append(int(line[i]))
-                        else :
-                            laser_direction.append(int(line[i]))
-                    self.laser_start.append(tuple(laser_origin))
-                    self.laser_path.append(tuple(laser_direction))
-                else :
-                    print("Encountering error!")
-
-
-        # Establishing the targets to be used in future locations
-        self.targets = []
-
-        # Extracting the data related to the required points that the laser must cross through in solution
-        # Looking for the part of the .bff file that includes 'P' referring to the points
-        # We want the expected length of the tuples to get the coordinates, otherwise it's some sort of problem
-        for line in raw_data:
-            points_set = []
-            if line.startswith('P') == True:
-                line = line.lstrip("P").split()
-                if len(line) == 2:
-                    for i in range(len(line)):
-                        points_set.append(int(line[i]))
-                    self.targets.append(tuple(points_set))
-                else :
-                    print("Encountering error!")
-
-        # Establishing a dictionary to include the information about inventory of blocks
-        # This is honestly the easiest out of the information because the blocks are labeled by their letters
-        self.blocks = {}
-
-        # We search the .bff file for information about each letter and include that integer available in our inventory dictionary
-        # Otherwise, they are set to 0 to not run in to any confusion
-        for line in raw_data:
-            if line[0] in ['A', 'B', 'C']:
-                key, value = line.strip().split()
-                self.blocks[key] = int(value)
-        if 'A' not in self.blocks:
-            self.blocks['A'] = 0
-        if 'B' not in self.blocks:
-            self.blocks['B'] = 0
-        if 'C' not in self.blocks:
-            self.blocks['C'] = 0    
-        
     def print_game_state(self):
         
         '''
@@ -155,6 +150,394 @@ class Game:
         print("Targets: {}".format(self.targets))
         print("Blocks: {}".format(self.blocks))        
 
+    def puzzle(self):
+
+        '''
+        This function freezes the information extracted by database() into a Puzzle object so that a solver can parse the
+        .bff file a single time and reuse the result for every candidate board.
+        **Returns**
+            puzzle: *Puzzle*
+                Immutable snapshot of the grid, lasers, targets, inventory and open positions of the game.
+        '''
+        if not hasattr(self, 'grid'):
+            self.database()
+        grid = tuple(tuple(row) for row in self.grid)
+        sample_space = tuple(Board(self.grid, self.laser_start, self.laser_path, self.targets).sample_function(self.grid))
+        blocks = tuple((block_type, self.blocks[block_type]) for block_type in ['A', 'B', 'C'])
+        return Puzzle(grid, tuple(self.laser_start), tuple(self.laser_path), frozenset(self.targets), blocks, sample_space)
+
+
+class PuzzleFormatError(ValueError):
+
+    '''
+    Raised by parse_bff when a puzzle breaks the .bff format, with the name of the file and the number of the line at
+    fault (0 when the problem is with the file as a whole).
+    '''
+
+    def __init__(self, name, line, message):
+        super().__init__('{}:{}: {}'.format(name, line, message))
+        self.name = name
+        self.line = line
+
+
+def parse_bff(text, name='<text>'):
+
+    '''
+    The parse bff function reads a puzzle in the .bff format in a single pass over its lines and checks it as it goes.
+    Everything after a '#' is a comment. The grid is the lines between GRID START and GRID STOP, with one of o, x, A, B
+    or C per spot (with or without spaces between them) and every row the same length. After that come the inventory
+    (A, B and C followed by a count, each at most once), lasers (L x y vx vy, with vx and vy 1 or -1) and targets
+    (P x y), the positions of lasers and targets on the half-block grid within the board. There must be at least one
+    laser and one target.
+    **Parameters**
+        text: *str*
+            The puzzle in the .bff format.
+        name: *str*
+            The name of the file, for the error messages.
+    **Returns**
+        grid : *list,list,str*
+            Nested list of strings that visualizes/contextualizes the base game state.
+        laser_start : *list,tuple*
+            List of tuples containing the starting position of the laser(s).
+        laser_path : *list,tuples*
+            List of tuples containing the direction of the laser(s).
+        targets : *list,tuples*
+            List of tuples containing the position of the targets.
+        blocks : *dict*
+            A dictionary with the types of blocks as keys and the number of blocks as values.
+    **Raises**
+        PuzzleFormatError
+            Naming the first line that breaks the format.
+    '''
+    grid = None
+    grid_open = False
+    laser_start = []
+    laser_path = []
+    targets = []
+    blocks = {}
+    # The positions can only be checked against the size of the grid once it is known, so their lines are kept
+    positions = []
+    number = 0
+
+    for number, line in enumerate(text.split('\n'), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if grid_open:
+            if line == 'GRID STOP':
+                if not grid:
+                    raise PuzzleFormatError(name, number, 'the grid has no rows')
+                grid_open = False
+                continue
+            # Like the original reader, a row is read one character at a time and the spaces between spots are optional,
+            # so 'o x o' and 'oxo' are the same row
+            row = [spot for spot in line if not spot.isspace()]
+            for spot in row:
+                if spot not in ('o', 'x', 'A', 'B', 'C'):
+                    raise PuzzleFormatError(name, number, 'unknown spot {!r} in the grid'.format(spot))
+            if grid and len(row) != len(grid[0]):
+                raise PuzzleFormatError(name, number, 'row of {} spots in a grid of {} columns'.format(len(row),
+                                                                                                     len(grid[0])))
+            grid.append(row)
+            continue
+        if line == 'GRID START':
+            if grid is not None:
+                raise PuzzleFormatError(name, number, 'a second grid')
+            grid = []
+            grid_open = True
+            grid_start = number
+            continue
+
+        kind, *fields = line.split()
+        if kind not in ('A', 'B', 'C', 'L', 'P'):
+            raise PuzzleFormatError(name, number, 'unknown line {!r}'.format(line))
+        try:
+            values = [int(field) for field in fields]
+        except ValueError:
+            raise PuzzleFormatError(name, number, '{} must be followed by whole numbers'.format(kind)) from None
+        if kind in ('A', 'B', 'C'):
+            if len(values) != 1 or values[0] < 0:
+                raise PuzzleFormatError(name, number, '{} must be followed by a single count'.format(kind))
+            if kind in blocks:
+                raise PuzzleFormatError(name, number, 'a second count of {} blocks'.format(kind))
+            blocks[kind] = values[0]
+        elif kind == 'L':
+            if len(values) != 4:
+                raise PuzzleFormatError(name, number, 'L must be followed by x, y, vx and vy')
+            if values[2] not in (-1, 1) or values[3] not in (-1, 1):
+                raise PuzzleFormatError(name, number, 'the direction of a laser must be 1 or -1 in x and y')
+            laser_start.append((values[0], values[1]))
+            laser_path.append((values[2], values[3]))
+            positions.append((number, 'laser', values[0], values[1]))
+        else:
+            if len(values) != 2:
+                raise PuzzleFormatError(name, number, 'P must be followed by x and y')
+            if (values[0], values[1]) in targets:
+                raise PuzzleFormatError(name, number, 'target {} {} given twice'.format(*values))
+            targets.append((values[0], values[1]))
+            positions.append((number, 'target', values[0], values[1]))
+
+    if grid is None:
+        raise PuzzleFormatError(name, 0, 'no GRID START')
+    if grid_open:
+        raise PuzzleFormatError(name, grid_start, 'GRID START without a GRID STOP')
+    if not laser_start:
+        raise PuzzleFormatError(name, 0, 'no lasers')
+    if not targets:
+        raise PuzzleFormatError(name, 0, 'no targets')
+    for line, what, x, y in positions:
+        if not (0 <= x <= 2 * len(grid[0]) and 0 <= y <= 2 * len(grid)):
+            raise PuzzleFormatError(name, line, '{} at {} {} is off the board'.format(what, x, y))
+    for block_type in ['A', 'B', 'C']:
+        blocks.setdefault(block_type, 0)
+    return grid, laser_start, laser_path, targets, blocks
+
+
+class Puzzle(namedtuple('Puzzle', ['grid', 'laser_start', 'laser_path', 'targets', 'blocks', 'sample_space'])):
+
+    '''
+    The puzzle class is a frozen version of everything the game class reads from a .bff file. Since nothing in it can be
+    changed, it can be built once and then shared by every candidate board (and every worker) without being re-read.
+    Its fields are:
+        grid: *tuple,tuple,str*
+            Nested tuple of strings that visualizes/contextualizes the base game state.
+        laser_start: *tuple,tuple*
+            Tuple of tuples containing the starting position of the laser(s).
+        laser_path: *tuple,tuple*
+            Tuple of tuples containing the direction of the laser(s).
+        targets: *frozenset,tuple*
+            Set of tuples containing the position of the targets.
+        blocks: *tuple,tuple*
+            Tuple of (block type, number of blocks) pairs for the inventory.
+        sample_space: *tuple,tuple*
+            Tuple of tuples indicating the locations where inventory of blocks can be placed.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_file(cls, file):
+
+        '''
+        This function reads and parses a .bff file a single time and returns the frozen puzzle.
+        **Parameters**
+            file : *str*
+                The name of file containing laser puzzle information for each level.
+        **Returns**
+            puzzle: *Puzzle*
+                Immutable snapshot of the game described by the file.
+        '''
+        G = Game(file)
+        G.database()
+        return G.puzzle()
+
+    @classmethod
+    def from_text(cls, text):
+
+        '''
+        This function parses the contents of a .bff file and returns the frozen puzzle.
+        **Parameters**
+            text : *str*
+                The puzzle in the .bff format.
+        **Returns**
+            puzzle: *Puzzle*
+                Immutable snapshot of the game described by the text.
+        '''
+        G = Game.from_text(text)
+        G.database()
+        return G.puzzle()
+
+    def inventory(self):
+
+        '''
+        This function returns a fresh dictionary of the inventory, which is the form the board class works with.
+        **Returns**
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+        '''
+        return dict(self.blocks)
+
+    def key(self):
+
+        '''
+        This function gives a hash of everything that decides the solutions of the puzzle: the grid, inventory, lasers and
+        targets. It is computed from the parsed puzzle, so two .bff files that only differ in comments, spacing or the
+        order of their lasers and targets have the same key.
+        **Returns**
+            key: *str*
+                Hexadecimal SHA-256 hash of the puzzle.
+        '''
+        lasers = sorted(list(start) + list(path) for start, path in zip(self.laser_start, self.laser_path))
+        content = [[list(row) for row in self.grid], sorted(self.blocks), lasers, sorted(self.targets)]
+        return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+    def text(self):
+
+        '''
+        This function writes the puzzle back out in the .bff format, so that Puzzle.from_text(puzzle.text()) gives the
+        same puzzle. Block types with none in the inventory are left out, like in the bundled files.
+        **Returns**
+            text: *str*
+                The puzzle in the .bff format.
+        '''
+        lines = ['GRID START'] + [' '.join(row) for row in self.grid] + ['GRID STOP', '']
+        lines += ['{} {}'.format(block_type, count) for block_type, count in self.blocks if count]
+        lines += ['']
+        lines += ['L {} {} {} {}'.format(x, y, vx, vy) for (x, y), (vx, vy) in zip(self.laser_start, self.laser_path)]
+        lines += ['']
+        lines += ['P {} {}'.format(x, y) for x, y in sorted(self.targets)]
+        return '\n'.join(lines) + '\n'
+
+
+def compile_catalogue(paths, output):
+
+    '''
+    The compile catalogue function reads many .bff files with parse_bff and writes them all into a single catalogue
+    file, which Catalogue reads back without parsing anything.
+    **Parameters**
+        paths: *list,str*
+            Paths of .bff files or of directories holding .bff files.
+        output: *str*
+            The catalogue file to write.
+    **Returns**
+        count: *int*
+            The number of puzzles in the catalogue.
+    '''
+    records = []
+    for path in puzzle_files(paths):
+        with open(path, 'r') as handle:
+            grid, laser_start, laser_path, targets, blocks = parse_bff(handle.read(), path)
+        if len(grid) > 255 or len(grid[0]) > 255:
+            raise PuzzleFormatError(path, 0, 'a catalogue only holds grids of up to 255 rows and columns')
+        # The counts are stored in 16 bits (the positions always fit, being on a grid of at most 255 by 255 blocks)
+        for what, count in [('A blocks', blocks['A']), ('B blocks', blocks['B']), ('C blocks', blocks['C']),
+                            ('lasers', len(laser_start)), ('targets', len(targets))]:
+            if count > 65535:
+                raise PuzzleFormatError(path, 0, 'a catalogue only holds up to 65535 {}'.format(what))
+        name = os.path.basename(path).encode()
+        record = [CATALOGUE_RECORD.pack(len(grid[0]), len(grid), blocks['A'], blocks['B'], blocks['C'],
+                                        len(laser_start), len(targets), len(name)),
+                  ''.join(''.join(row) for row in grid).encode('ascii')]
+        record += [CATALOGUE_LASER.pack(x, y, vx, vy) for (x, y), (vx, vy) in zip(laser_start, laser_path)]
+        record += [CATALOGUE_TARGET.pack(x, y) for x, y in targets]
+        record.append(name)
+        records.append(b''.join(record))
+
+    offset = CATALOGUE_HEADER.size + CATALOGUE_OFFSET.size * len(records)
+    with open(output, 'wb') as file:
+        file.write(CATALOGUE_HEADER.pack(CATALOGUE_MAGIC, CATALOGUE_VERSION, len(records)))
+        for record in records:
+            file.write(CATALOGUE_OFFSET.pack(offset))
+            offset += len(record)
+        for record in records:
+            file.write(record)
+    return len(records)
+
+
+class Catalogue:
+
+    '''
+    The catalogue class reads puzzles out of a catalogue file written by compile_catalogue. The file is memory mapped,
+    so opening it reads nothing, every process that opens it shares the same pages, and getting a puzzle by its number
+    only touches the bytes of that one puzzle: its offset is looked up in the index and its fields are unpacked straight
+    from the mapped file, with no text to parse.
+    '''
+
+    def __init__(self, path):
+
+        '''
+        This function opens a catalogue.
+        **Parameters**
+            path: *str*
+                The catalogue file.
+        '''
+        self.path = path
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = CATALOGUE_HEADER.unpack_from(self.data, 0)
+        if magic != CATALOGUE_MAGIC:
+            self.data.close()
+            raise ValueError("{} is not a puzzle catalogue".format(path))
+        if version != CATALOGUE_VERSION:
+            self.data.close()
+            raise ValueError("{} is a version {} catalogue, expected version {}".format(path, version,
+                                                                                        CATALOGUE_VERSION))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def record(self, index):
+
+        '''
+        This function finds the record of a puzzle.
+        **Parameters**
+            index: *int*
+                The number of the puzzle, in the order the files were compiled.
+        **Returns**
+            offset: *int*
+                Where the record starts in the file.
+            header: *tuple,int*
+                The width, height, counts of A, B and C blocks, number of lasers and targets and length of the name.
+        '''
+        if not 0 <= index < self.count:
+            raise IndexError("catalogue index out of range")
+        offset = CATALOGUE_OFFSET.unpack_from(self.data, CATALOGUE_HEADER.size + index * CATALOGUE_OFFSET.size)[0]
+        return offset, CATALOGUE_RECORD.unpack_from(self.data, offset)
+
+    def __getitem__(self, index):
+
+        '''
+        This function reads a puzzle.
+        **Parameters**
+            index: *int*
+                The number of the puzzle, in the order the files were compiled.
+        **Returns**
+            puzzle: *Puzzle*
+                The puzzle, the same as Puzzle.from_file gives for its .bff file.
+        '''
+        offset, (width, height, a, b, c, lasers, targets, name_length) = self.record(index)
+        position = offset + CATALOGUE_RECORD.size
+        spots = self.data[position:position + width * height].decode('ascii')
+        grid = tuple(tuple(spots[j * width:(j + 1) * width]) for j in range(height))
+        position += width * height
+        beams = [CATALOGUE_LASER.unpack_from(self.data, position + k * CATALOGUE_LASER.size) for k in range(lasers)]
+        position += lasers * CATALOGUE_LASER.size
+        points = [CATALOGUE_TARGET.unpack_from(self.data, position + k * CATALOGUE_TARGET.size) for k in range(targets)]
+        sample_space = tuple((i, j) for j in range(height) for i in range(width) if grid[j][i] == 'o')
+        return Puzzle(grid, tuple((x, y) for x, y, vx, vy in beams), tuple((vx, vy) for x, y, vx, vy in beams),
+                      frozenset(points), (('A', a), ('B', b), ('C', c)), sample_space)
+
+    def name(self, index):
+
+        '''
+        This function gives the name of the .bff file a puzzle was compiled from.
+        **Parameters**
+            index: *int*
+                The number of the puzzle.
+        **Returns**
+            name: *str*
+                The file name, without its directory.
+        '''
+        offset, (width, height, a, b, c, lasers, targets, name_length) = self.record(index)
+        position = (offset + CATALOGUE_RECORD.size + width * height + lasers * CATALOGUE_LASER.size +
+                    targets * CATALOGUE_TARGET.size)
+        return self.data[position:position + name_length].decode()
+
+    def close(self):
+        self.data.close()
+
+
+class CatalogueEntry(namedtuple('CatalogueEntry', ['path', 'index'])):
+
+    '''
+    A puzzle in a catalogue named by the catalogue file and its number, which is all the batch solver sends a worker.
+    '''
+    __slots__ = ()
+
+
 class Board:
 
     '''
@@ -176,14 +559,26 @@ class Board:
                 List of tuples containing the starting position of the laser(s).
             path: *list,tuples* 
                 List of tuples containing the direction of the laser(s)
-            sets: *dict* 
-                A dictionary with the types of blocks as keys and the number of blocks as values.
+            sets: *list,tuple* 
+                List of tuples containing the position of the targets.
         '''
         self.grid = grid
         self.origin = origin
         self.path = path
         self.sets = sets
 
+        # The compact mesh of the fixed blocks is built a single time, candidates only copy it and write their blocks
+        self.stride = 2 * len(grid[0]) + 3
+        self.base_mesh = self.make_mesh(grid)
+
+        # Every target gets its own bit, and target_bits gives the bits of the target (if any) at each compact mesh index
+        # A laser then only has to OR these together, and a board is solved once every bit in all_targets is set
+        self.target_list = sorted(sets)
+        self.target_bits = [0] * len(self.base_mesh)
+        for k, (x, y) in enumerate(self.target_list):
+            self.target_bits[self.mesh_index(x, y)] |= 1 << k
+        self.all_targets = (1 << len(self.target_list)) - 1
+
 
     def sample_function(self, grid):
         '''
@@ -241,6 +636,294 @@ class Board:
 
         return grid
 
+    def sample_placement(self, sample_space, blocks, rng=random):
+
+        '''
+        The sample placement function draws a single random layout of the inventory, like sample_board, but returns it as
+        a list of blocks to place instead of writing it into a grid.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+            rng: *random.Random*
+                The random number generator to draw from, by default the one of the random module.
+        **Returns**
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing one candidate layout.
+        '''
+        types = []
+        for block_type in ['C', 'B', 'A']:
+            types += [block_type] * blocks[block_type]
+        return list(zip(rng.sample(sample_space, len(types)), types))
+
+    def placements(self, sample_space, blocks):
+
+        '''
+        The placements function lists every distinct way the inventory of blocks can be arranged on the open spots of the
+        game grid, exactly once each. We first pick which positions are used (combinations) and then every distinct way
+        of assigning the block types to those positions, so identical blocks are never swapped around for nothing.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+        **Yields**
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing one candidate layout.
+        '''
+        # Building the flat list of block types once so we know how many positions each layout needs
+        types = []
+        for block_type in ['A', 'B', 'C']:
+            types += [block_type] * blocks[block_type]
+
+        # The distinct orderings of the block types only depend on the inventory, so we compute them a single time
+        orders = list(self.block_orders({'A': blocks['A'], 'B': blocks['B'], 'C': blocks['C']}, len(types)))
+        for options in itertools.combinations(sample_space, len(types)):
+            for order in orders:
+                yield list(zip(options, order))
+
+    def beam_reach(self, sample_space):
+
+        '''
+        The beam reach function finds everything a laser could ever get to, whatever blocks end up in the open spots. It
+        follows the beams like Laser.laser_prediction, but at an open spot a beam both goes straight on and reflects
+        (which covers every block type), so every position and direction any layout could give a beam is visited once.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+        **Returns**
+            reached: *set,int*
+                Compact mesh indices of the open spots some beam can run into.
+            mask: *int*
+                Bitmask of the targets some beam can pass through.
+        '''
+        return self.mesh_reach(self.mesh_overlay([(spot, '?') for spot in sample_space]))
+
+    def mesh_reach(self, mesh, reflect_undecided=True):
+
+        '''
+        The mesh reach function is beam_reach for a mesh in which some of the open spots are already decided, as the
+        backtracking solver has them. Only the undecided spots are tried both ways.
+        **Parameters**
+            mesh: *bytearray*
+                Flat compact mesh, with UNDECIDED for the spots that could still get any block.
+            reflect_undecided: *bool*
+                Whether a block that reflects could still go in an undecided spot. Without one, a beam only goes straight
+                on there (or is stopped).
+        **Returns**
+            reached: *set,int*
+                Compact mesh indices of the undecided spots some beam can run into.
+            mask: *int*
+                Bitmask of the targets some beam can pass through.
+        '''
+        stride = self.stride
+        reached = set()
+        seen = set()
+        mask = 0
+        beams = [(x, y, vx, vy) for (x, y), (vx, vy) in zip(self.origin, self.path)]
+        while beams:
+            x, y, vx, vy = beams.pop()
+            index = (y + 1) * stride + x + 1
+            if mesh[index] == OUTSIDE or (index, vx, vy) in seen:
+                continue
+            seen.add((index, vx, vy))
+            mask |= self.target_bits[index]
+            block_index = index + vy * stride if x & 1 else index + vx
+            if mesh[block_index] == UNDECIDED:
+                reached.add(block_index)
+                reflect, transmit = reflect_undecided, True
+            else:
+                reflect, transmit = BLOCK_PROPERTIES[mesh[block_index]]
+            if transmit:
+                beams.append((x + vx, y + vy, vx, vy))
+            if reflect:
+                rx, ry = (vx, -vy) if x & 1 else (-vx, vy)
+                beams.append((x + rx, y + ry, rx, ry))
+        return reached, mask
+
+    def reachable_spots(self, sample_space):
+
+        '''
+        The reachable spots function finds the open spots a laser could ever run into (see beam_reach). A block in an
+        open spot no beam can reach never changes the outcome of a layout.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+        **Returns**
+            reachable: *list,tuple*
+                The open spots some beam can run into, in the order of sample_space.
+        '''
+        reached = self.beam_reach(sample_space)[0]
+        return [spot for spot in sample_space if self.cell_index(*spot) in reached]
+
+    def impossible_targets(self, sample_space):
+
+        '''
+        The impossible targets function finds the targets no layout can ever get a laser to (see beam_reach). A puzzle
+        with any of them has no solution, which we know before testing a single layout.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+        **Returns**
+            impossible: *list,tuple*
+                List of tuples containing the position of the targets that cannot be hit.
+        '''
+        return self.missing_targets(self.beam_reach(sample_space)[1])
+
+    def canonical_placements(self, sample_space, blocks, prefix=()):
+
+        '''
+        The canonical placements function lists one layout of every set of layouts that the lasers cannot tell apart. Two
+        layouts look the same to the lasers when they agree on every open spot a beam runs into, since the spots no beam
+        runs into cannot change where the beams go. So the open spots are decided in the order the beams reach them (as A,
+        B, C or left empty, like the backtracking solver does), and once no beam reaches an undecided spot anymore the
+        blocks left over go into one fixed dump position: the first undecided spots, the ones no beam could ever reach
+        (see reachable_spots) first. Every layout found by the placements function is equivalent to exactly one of
+        these, so finding no solution among them still means the puzzle has none.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+            prefix: *tuple,str*
+                Only list the layouts of one shard from canonical_prefixes, named by its first decisions.
+        **Yields**
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing one candidate layout.
+        '''
+        for decided, spare, left in self.canonical_search(sample_space, blocks, prefix, None):
+            types = ['A'] * left['A'] + ['B'] * left['B'] + ['C'] * left['C']
+            yield decided + list(zip(spare, types))
+
+    def canonical_prefixes(self, sample_space, blocks, depth):
+
+        '''
+        The canonical prefixes function splits the layouts from canonical_placements into disjoint shards, named by the
+        first few decisions (block type or 'o' for empty) taken at the spots the beams reach first.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+            depth: *int*
+                How many decisions name each shard. Shards whose beams settle sooner are named by fewer.
+        **Yields**
+            prefix: *tuple,str*
+                A tuple of block types naming one shard.
+        '''
+        return self.canonical_search(sample_space, blocks, (), depth)
+
+    def canonical_search(self, sample_space, blocks, prefix, depth):
+
+        '''
+        The canonical search function walks the decisions behind canonical_placements and canonical_prefixes.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+            prefix: *tuple,str*
+                Decisions the walk is forced to take first.
+            depth: *int*
+                If given, the walk stops after this many decisions and yields them instead of layouts.
+        **Yields**
+            decided: *list,tuple*
+                The blocks placed on spots a beam runs into, as ((i, j), block_type) pairs. When depth is given only a
+                tuple of decisions is yielded instead.
+            spare: *list,tuple*
+                The undecided spots, in the order of the dump position. Any way of putting the left over blocks on them
+                gives a layout the lasers cannot tell apart from the others.
+            left: *dict*
+                The number of blocks of each type left over.
+        '''
+        laser = Laser(self.origin, self.path)
+        reachable = self.reachable_spots(sample_space)
+        dump_order = [spot for spot in sample_space if spot not in reachable] + reachable
+        spot_of = {self.cell_index(i, j): (i, j) for i, j in sample_space}
+        mesh = self.mesh_overlay([(spot, '?') for spot in sample_space])
+        block_counts = {'A': blocks['A'], 'B': blocks['B'], 'C': blocks['C']}
+        decided = []
+        path = []
+
+        def search(undecided):
+            frontier = laser.partial_trajectory(mesh, self.stride)[1]
+            if depth is not None and (not frontier or len(path) == depth):
+                yield tuple(path)
+                return
+            if not frontier:
+                # The beams are settled, so the blocks left over can go on any of the spots still undecided
+                spare = [spot for spot in dump_order if mesh[self.cell_index(*spot)] == UNDECIDED]
+                yield list(decided), spare, dict(block_counts)
+                return
+            index = frontier[0]
+            left = block_counts['A'] + block_counts['B'] + block_counts['C']
+            choices = [prefix[len(path)]] if len(path) < len(prefix) else ['A', 'B', 'C', 'o']
+            for block_type in choices:
+                if block_type != 'o' and block_counts[block_type] == 0:
+                    continue
+                if block_type == 'o' and left > undecided - 1:
+                    continue
+                mesh[index] = BLOCK_CODES[block_type]
+                path.append(block_type)
+                if block_type != 'o':
+                    block_counts[block_type] -= 1
+                    decided.append((spot_of[index], block_type))
+                yield from search(undecided - 1)
+                path.pop()
+                if block_type != 'o':
+                    block_counts[block_type] += 1
+                    decided.pop()
+            mesh[index] = UNDECIDED
+
+        if block_counts['A'] + block_counts['B'] + block_counts['C'] <= len(sample_space):
+            yield from search(len(sample_space))
+
+    def block_orders(self, block_counts, length):
+
+        '''
+        The block orders function generates every distinct ordering of a multiset of blocks (for example 'AAC', 'ACA'
+        and 'CAA' for two reflect blocks and one refract block) without ever repeating one.
+        **Parameters**
+            block_counts: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks left to order as values.
+            length: *int*
+                The number of blocks left to order.
+        **Yields**
+            order: *tuple,str*
+                A tuple of block types.
+        '''
+        if length == 0:
+            yield ()
+            return
+        for block_type in ['A', 'B', 'C']:
+            if block_counts[block_type] > 0:
+                block_counts[block_type] -= 1
+                for rest in self.block_orders(block_counts, length - 1):
+                    yield (block_type,) + rest
+                block_counts[block_type] += 1
+
+    def layout_count(self, sample_space, blocks):
+
+        '''
+        The layout count function works out how many layouts the placements function lists without listing them: the
+        ways to pick the used open spots times the distinct orderings of the block types on them. The canonical layouts
+        are some of these, so this is also a bound on how many of those there are.
+        **Parameters**
+            sample_space: *list,tuple*
+                A list of tuples indicating the locations where inventory of blocks can be placed.
+            blocks: *dict*
+                A dictionary with the types of blocks as keys and the number of blocks as values.
+        **Returns**
+            count: *int*
+                The number of distinct layouts.
+        '''
+        length = blocks['A'] + blocks['B'] + blocks['C']
+        orders = math.factorial(length)
+        for block_type in ['A', 'B', 'C']:
+            orders //= math.factorial(blocks[block_type])
+        return math.comb(len(sample_space), length) * orders
+
     def make_board(self,grid):
         
         '''
@@ -263,251 +946,1292 @@ class Board:
             for j in range(len(grid[0])):
                 meshgrid[2*i+1][2*j+1] = grid[i][j]
         return meshgrid
-    
 
-class Blocks:
+    def mesh_index(self, x, y):
 
-    '''
-    The blocks class establishes the properties of the three different block types. We want some of them to reflect, some
-    of them to transmit, or to do neither depending on which of the three blocks we are dealing with.
-    '''
-    def __init__(self,x,y):
         '''
-        This function initializes the location of the block type with x and y coordinates. 
-        ** Parameters**
+        The mesh index function turns a position on the laser board (the same coordinates as the .bff file uses for lasers
+        and targets) into its index in the compact mesh from make_mesh.
+        **Parameters**
             x: *int*
-                The row position within the nested lists.
-            y: *int* 
-                The column position within the nested lists.
+                The column position on the laser board.
+            y: *int*
+                The row position on the laser board.
+        **Returns**
+            index: *int*
+                Index of that position in the compact mesh.
         '''
-        self.x = x
-        self.y = y
+        return (y + 1) * self.stride + x + 1
+
+    def missing_targets(self, mask):
 
-    def prop(self, meshgrid):
         '''
-        This function specifies the 'reflect' and 'transmit' properties as booleans
-        **Parameter**
-            meshgrid: *list, list, str*
-                Nested list of strings that visualizes/contextualizes the laser board state better.
+        The missing targets function turns a bitmask of hit targets back into the targets that were not hit.
+        **Parameters**
+            mask: *int*
+                Bitmask of hit targets, as returned by Laser.target_trajectory.
         **Returns**
-            self.reflect: *boolean*
-                Ability to reflect the laser or not based on the location on the board
-            self.transmit: *boolean*
-                Ability to transmit the laser or not based on the location on the board
+            missing: *list,tuple*
+                List of tuples containing the position of the targets that were not hit.
         '''
-        # Checks to see which block type we are dealing with by looking at the letter
-        # Then we give it the appropriate qualities.
-        if meshgrid[self.y][self.x] == 'A':
-            self.reflect = True
-            self.transmit = False
-        elif meshgrid[self.y][self.x] == 'B':
-            self.reflect = False
-            self.transmit = False
-        elif meshgrid[self.y][self.x] == 'C':
-            self.reflect = True
-            self.transmit = True
-        else:
-            self.reflect = False
-            self.transmit = True
-        return self.reflect, self.transmit
+        return [target for k, target in enumerate(self.target_list) if not mask >> k & 1]
 
+    def cell_index(self, i, j):
 
-class Laser:
+        '''
+        The cell index function gives the compact mesh index of the spot in column i and row j of the game grid.
+        **Parameters**
+            i: *int*
+                The column of the spot on the game grid.
+            j: *int*
+                The row of the spot on the game grid.
+        **Returns**
+            index: *int*
+                Index of that spot in the compact mesh.
+        '''
+        return (2 * j + 2) * self.stride + 2 * i + 2
 
-    '''
-    The laser class estblishes the properties of the laser including what direction the lasers are going, the starting locations
-    of any of the lasers, and looking at what happens to it when we update it as we go with changing the locations of blocks
-    on the state of the board. We need to be able to understand how different blocks effect the laser's properties and then
-    update that within it.
-    '''
+    def make_mesh(self, grid):
 
-    def __init__(self, start_point, path):
-        
         '''
-        This function initializes the starting location and the direction of the laser(s). 
-        ** Parameters**
-            start_point: *list,tuple*
-                List of tuples containing the starting position of the laser(s).
-            path: *list,tuples* 
+        The make mesh function builds the same laser board as make_board, but as a flat bytearray of integer block codes
+        (see BLOCK_CODES) instead of a nested list of strings. It has an extra ring of OUTSIDE around it, so the position
+        next to any laser position always exists and a beam knows it has left the board by landing on OUTSIDE.
+        **Parameters**
+            grid: *list, list, str*
+                Nested list of strings that visualizes/contextualizes the game state.
+        **Returns**
+            mesh: *bytearray*
+                Flat compact mesh, row by row with self.stride entries per row.
+        '''
+        width = 2 * len(grid[0]) + 1
+        height = 2 * len(grid) + 1
+        mesh = bytearray([OUTSIDE]) * (self.stride * (height + 2))
+        for y in range(height):
+            start = self.mesh_index(0, y)
+            mesh[start:start + width] = bytes(width)
+        for j, row in enumerate(grid):
+            for i, block in enumerate(row):
+                mesh[self.cell_index(i, j)] = BLOCK_CODES[block]
+        return mesh
+
+    def mesh_overlay(self, placement):
+
+        '''
+        The mesh overlay function copies the compact mesh of the fixed blocks and writes a layout of blocks into it, which
+        is all the work a candidate needs before its lasers can be traced.
+        **Parameters**
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing the blocks to place.
+        **Returns**
+            mesh: *bytearray*
+                Flat compact mesh with the blocks placed.
+        '''
+        mesh = bytearray(self.base_mesh)
+        for (i, j), block_type in placement:
+            mesh[self.cell_index(i, j)] = BLOCK_CODES[block_type]
+        return mesh
+
+    def placement_batch(self, placements):
+
+        '''
+        The placement batch function writes a list of layouts into a single NumPy array of block codes, which is the input
+        Laser.batch_trajectory works on. Every board in the batch holds the fixed blocks of the base grid as well.
+        **Parameters**
+            placements: *list,list,tuple*
+                List of layouts, each a list of ((i, j), block_type) pairs.
+        **Returns**
+            boards: *numpy.ndarray*
+                Array of shape (N, H, W) holding the block code (see BLOCK_CODES) of every spot of every board.
+        '''
+        base = np.array([[BLOCK_CODES[block] for block in row] for row in self.grid], dtype=np.uint8)
+        boards = np.repeat(base[np.newaxis], len(placements), axis=0)
+        for n, placement in enumerate(placements):
+            for (i, j), block_type in placement:
+                boards[n, j, i] = BLOCK_CODES[block_type]
+        return boards
+
+    def overlay(self, grid, placement):
+
+        '''
+        The overlay function copies a base grid and places a layout of blocks on top of it. The base grid itself is never
+        touched, so the same parsed puzzle can be reused for every candidate layout.
+        **Parameters**
+            grid: *tuple,tuple,str*
+                Nested tuple (or list) of strings that visualizes/contextualizes the base game state.
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing the blocks to place.
+        **Returns**
+            grid: *list,list,str*
+                Nested list of strings that visualizes/contextualizes a state of the game with added inventory blocks.
+        '''
+        new_grid = [list(row) for row in grid]
+        for (i, j), block_type in placement:
+            new_grid[j][i] = block_type
+        return new_grid
+    
+
+class Blocks:
+
+    '''
+    The blocks class establishes the properties of the three different block types. We want some of them to reflect, some
+    of them to transmit, or to do neither depending on which of the three blocks we are dealing with.
+    '''
+    def __init__(self,x,y):
+        '''
+        This function initializes the location of the block type with x and y coordinates. 
+        ** Parameters**
+            x: *int*
+                The row position within the nested lists.
+            y: *int* 
+                The column position within the nested lists.
+        '''
+        self.x = x
+        self.y = y
+
+    def prop(self, meshgrid):
+        '''
+        This function specifies the 'reflect' and 'transmit' properties as booleans
+        **Parameter**
+            meshgrid: *list, list, str*
+                Nested list of strings that visualizes/contextualizes the laser board state better.
+        **Returns**
+            self.reflect: *boolean*
+                Ability to reflect the laser or not based on the location on the board
+            self.transmit: *boolean*
+                Ability to transmit the laser or not based on the location on the board
+        '''
+        # Looks up the properties of the block type from its letter in the shared table
+        self.reflect, self.transmit = BLOCK_PROPERTIES[BLOCK_CODES.get(meshgrid[self.y][self.x], EMPTY)]
+        return self.reflect, self.transmit
+
+
+class TraceCache:
+
+    '''
+    The trace cache remembers what each laser did on boards that were already traced. Which open spots a laser runs into
+    only depends on what was in the open spots it ran into before, so the results are stored like a tree: the entry for
+    the blocks seen so far tells us the next open spot to look at, until we reach the stored result. Entries are evicted
+    least recently used first once there are more than maxsize of them, and the hits and misses are counted.
+    '''
+
+    def __init__(self, free_cells, target_bits=None, maxsize=100000):
+
+        '''
+        This function initializes an empty cache.
+        **Parameters**
+            free_cells: *list,int*
+                Compact mesh indices of the open spots, the only spots that differ between boards of one puzzle.
+            target_bits: *list,int*
+                The target bits of each compact mesh index (see Board.target_bits), used for the stored target bitmasks.
+            maxsize: *int*
+                The most entries kept.
+        '''
+        self.free = frozenset(free_cells)
+        self.target_bits = target_bits
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, laser, meshgrid):
+
+        '''
+        This function looks for a stored result of a laser on the given board.
+        **Parameters**
+            laser: *int*
+                Which of the lasers of the puzzle it is.
+            meshgrid: *bytearray*
+                Flat compact mesh of the board.
+        **Returns**
+            result: *tuple*
+                The stored result, or None if this board has not been seen yet.
+        '''
+        key = (laser,)
+        entry = self.entries.get(key)
+        while isinstance(entry, int):
+            self.entries.move_to_end(key)
+            key += (meshgrid[entry],)
+            entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, laser, reads, result):
+
+        '''
+        This function stores the result of tracing a laser.
+        **Parameters**
+            laser: *int*
+                Which of the lasers of the puzzle it is.
+            reads: *dict*
+                The spots the laser ran into, in the order it reached them, mapped to the block code they held.
+            result: *tuple*
+                What the laser did on this board.
+        '''
+        key = (laser,)
+        for index, block in reads.items():
+            if index not in self.free:
+                continue
+            self.entries[key] = index
+            self.entries.move_to_end(key)
+            key += (block,)
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class Laser:
+
+    '''
+    The laser class estblishes the properties of the laser including what direction the lasers are going, the starting locations
+    of any of the lasers, and looking at what happens to it when we update it as we go with changing the locations of blocks
+    on the state of the board. We need to be able to understand how different blocks effect the laser's properties and then
+    update that within it.
+    '''
+
+    def __init__(self, start_point, path, max_steps=100000, cache=None):
+        
+        '''
+        This function initializes the starting location and the direction of the laser(s). 
+        ** Parameters**
+            start_point: *list,tuple*
+                List of tuples containing the starting position of the laser(s).
+            path: *list,tuples* 
                 List of tuples containing the direction of the laser(s).
+            max_steps: *int*
+                The most steps a single beam is followed for. Beams that loop are already stopped when they repeat a
+                position and direction, so this is only a safety net.
+            cache: *TraceCache*
+                Optional cache of traced lasers that trajectory reuses between boards.
         '''
         self.source = start_point
         self.direction = path
+        self.max_steps = max_steps
+        self.cache = cache
+
+        # The number of beam steps actually followed, which boards taken from the cache do not add to
+        self.steps = 0
+
+        # The parts of the beams that only pass fixed blocks, once precompute has traced them
+        self.prefixes = None
+
 
+    def laser_prediction(self, x, y, vx, vy, meshgrid, stride, intercepts, splits, seen=None, reads=None,
+                         target_bits=None, mask=0, all_targets=-1):
+
+        '''
+        The laser prediction function follows a single beam through the compact mesh until it leaves the board or hits an
+        opaque block. The beam is kept as four plain integers and every position it passes is added to intercepts as a
+        compact mesh index. At every position the beam is on the edge of the block it is heading into, which reflects it
+        (flipping the part of the direction that points into the block), stops it, or lets it through according to
+        BLOCK_PROPERTIES. A refract block also starts a second beam going straight through, which is added to splits.
+        A beam caught between blocks would go around forever, so it is stopped as soon as it is back in a position and
+        direction it (or any beam sharing the same seen set) already had, or after max_steps steps.
+        **Parameters**
+            x, y: *int*
+                The position the beam starts from.
+            vx, vy: *int*
+                The direction the beam starts in.
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+            intercepts: *set,int*
+                Set the compact mesh indices of the positions the beam passes through are added to, or None.
+            splits: *list,tuple*
+                List the (x, y, vx, vy) beams split off by refract blocks are added to.
+            seen: *set,int*
+                Set of the packed position and direction states already followed. A new set is used if none is given.
+            reads: *dict*
+                If given, every spot the beam runs into is recorded here (index to block code) the first time it is
+                reached. These are the only spots that can change what the beam does.
+            target_bits: *list,int*
+                If given, the target bits of each compact mesh index (see Board.target_bits), which are ORed into mask.
+            mask: *int*
+                Bitmask of the targets already hit.
+            all_targets: *int*
+                Bitmask with every target set. The beam is not followed any further once mask reaches it.
+        **Returns**
+            mask: *int*
+                Bitmask of the targets hit, including the ones already in mask.
+        '''
+        if seen is None:
+            seen = set()
+        for step in range(self.max_steps):
+            index = (y + 1) * stride + x + 1
+            if meshgrid[index] == OUTSIDE:
+                return mask
+
+            # The position and direction packed into one integer is the state of the beam
+            state = (index << 2) | (vx > 0) << 1 | (vy > 0)
+            if state in seen:
+                return mask
+            seen.add(state)
+            if intercepts is not None:
+                intercepts.add(index)
+            if target_bits is not None:
+                mask |= target_bits[index]
+                if mask == all_targets:
+                    return mask
+
+            # On an even column the beam is on the left/right edge of a block, otherwise on its top/bottom edge
+            block_index = index + vy * stride if x & 1 else index + vx
+            if reads is not None and block_index not in reads:
+                reads[block_index] = meshgrid[block_index]
+            reflect, transmit = BLOCK_PROPERTIES[meshgrid[block_index]]
+            if reflect:
+                if transmit:
+                    splits.append((x + vx, y + vy, vx, vy))
+                if x & 1:
+                    vy = -vy
+                else:
+                    vx = -vx
+            elif not transmit:
+                return mask
+            x += vx
+            y += vy
+        return mask
+
+    def precompute(self, meshgrid, stride, target_bits):
+
+        '''
+        The precompute function traces every laser through the fixed blocks of the puzzle a single time, up to the first
+        open spot each beam runs into. That part of a beam is the same on every candidate board, so source_trajectory
+        and target_trajectory start the beams from where it ends instead of following it again on every candidate.
+        **Parameters**
+            meshgrid: *bytearray*
+                Flat compact mesh of the fixed blocks with UNDECIDED in every open spot.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+            target_bits: *list,int*
+                The target bits of each compact mesh index (see Board.target_bits).
+        **Returns**
+            entries: *list,int*
+                Compact mesh indices of the open spots the lasers run into first, in the order they are reached.
+        '''
+        self.prefixes = []
+        for (x, y), (vx, vy) in zip(self.source, self.direction):
+            intercepts = set()
+            intercept_new = set()
+            splits = []
+            seen = set()
+            entries = []
+            mask = self.prefix_prediction(x, y, vx, vy, meshgrid, stride, intercepts, splits, seen, entries, True,
+                                          target_bits, 0)
+            j = 0
+            while j < len(splits):
+                (sx, sy, svx, svy) = splits[j]
+                mask = self.prefix_prediction(sx, sy, svx, svy, meshgrid, stride, intercept_new, splits, seen, entries,
+                                              False, target_bits, mask)
+                j += 1
+            self.prefixes.append((frozenset(intercepts), frozenset(intercept_new), tuple(splits), frozenset(seen),
+                                  tuple(entries), mask))
 
-    def laser_prediction(self, path, intercepts, grid, meshgrid, path_1, intercept_new):
+        # Tracing all the lasers together starts from every entry with every prefix already seen
+        self.prefix_seen = frozenset().union(*(prefix[3] for prefix in self.prefixes))
+        self.prefix_entries = tuple(entry for prefix in self.prefixes for entry in prefix[4])
+        self.prefix_mask = 0
+        for prefix in self.prefixes:
+            self.prefix_mask |= prefix[5]
+        first = []
+        for x, y, vx, vy, main in self.prefix_entries:
+            index = (y + 1) * stride + x + 1
+            block_index = index + vy * stride if x & 1 else index + vx
+            if block_index not in first:
+                first.append(block_index)
+        return first
+
+    def prefix_prediction(self, x, y, vx, vy, meshgrid, stride, intercepts, splits, seen, entries, main, target_bits,
+                          mask):
+
+        '''
+        The prefix prediction function follows a beam like laser_prediction, but stops it in front of the first open spot
+        (UNDECIDED) it runs into and adds where it stopped to entries, without marking that position as seen.
+        **Parameters**
+            x, y, vx, vy, meshgrid, stride, intercepts, splits, seen, target_bits, mask:
+                The same as for laser_prediction.
+            entries: *list,tuple*
+                List the (x, y, vx, vy, main) beams stopped in front of an open spot are added to.
+            main: *bool*
+                Whether the beam is the laser itself rather than a beam split off it.
+        **Returns**
+            mask: *int*
+                Bitmask of the targets hit, including the ones already in mask.
+        '''
+        for step in range(self.max_steps):
+            index = (y + 1) * stride + x + 1
+            if meshgrid[index] == OUTSIDE:
+                return mask
+            state = (index << 2) | (vx > 0) << 1 | (vy > 0)
+            if state in seen:
+                return mask
+            block_index = index + vy * stride if x & 1 else index + vx
+            if meshgrid[block_index] == UNDECIDED:
+                entries.append((x, y, vx, vy, main))
+                return mask
+            seen.add(state)
+            intercepts.add(index)
+            mask |= target_bits[index]
+            reflect, transmit = BLOCK_PROPERTIES[meshgrid[block_index]]
+            if reflect:
+                if transmit:
+                    splits.append((x + vx, y + vy, vx, vy))
+                if x & 1:
+                    vy = -vy
+                else:
+                    vx = -vx
+            elif not transmit:
+                return mask
+            x += vx
+            y += vy
+        return mask
+
+    def trajectory(self, path, grid, meshgrid):
         
         '''
-        The laser prediction function attempts to see where the laser intersects with the new board state with the different
-        blocks and then setting those. We will later use this information to predict where the laser is going for future 
-        prediction techniques.
+        The trajectory function predicts the trajectory of the laser(s) using the laser_prediction function. It keeps a
+        queue of beams: every laser starts one, and every time a refract block splits a beam the split beam joins the
+        queue, so chained refractions are followed as far as they go. All beams share one set of seen positions and
+        directions, so no part of a path is ever followed twice and the work per board stays bounded.
+        **Parameters**
+            path: *list,tuples* 
+                List of tuples containing the direction of the laser(s).
+            grid: *list,list,str*
+                Nested list of strings that visualizes/contextualizes the base game state.
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+        **Returns**
+            final_intercept_list: *set,int*
+                Set of compact mesh indices of the positions the lasers pass through.
+            splits: *list,tuple*
+                List of the (x, y, vx, vy) beams split off by refract blocks.
+            intercept_new : *set,int*
+                Set of compact mesh indices of the positions the split beams pass through.
+        '''
+        stride = 2 * len(grid[0]) + 3
+        if self.cache is not None:
+            return self.cached_trajectory(meshgrid, stride)
+        final_intercept_list = set()
+        intercept_new = set()
+        splits = []
+        seen = set()
+        for (x, y), (vx, vy) in zip(self.source, self.direction):
+            self.laser_prediction(x, y, vx, vy, meshgrid, stride, final_intercept_list, splits, seen)
+
+        # The splits list doubles as the queue of beams still to follow, and following a beam can add more to it
+        k = 0
+        while k < len(splits):
+            (sx, sy, svx, svy) = splits[k]
+            self.laser_prediction(sx, sy, svx, svy, meshgrid, stride, intercept_new, splits, seen)
+            k += 1
+        self.steps += len(seen)
+        return final_intercept_list, splits, intercept_new
+
+    def cached_trajectory(self, meshgrid, stride):
+
+        '''
+        The cached trajectory function gives the same result as trajectory, but traces each laser (with all of its split
+        beams) on its own and remembers the result in self.cache, keyed on the blocks in the open spots that laser ran
+        into. A later board with the same blocks in those spots reuses the result without following the beam again, no
+        matter what it has in the spots the laser never reached.
+        **Parameters**
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+        **Returns**
+            final_intercept_list: *set,int*
+                Set of compact mesh indices of the positions the lasers pass through.
+            splits: *list,tuple*
+                List of the (x, y, vx, vy) beams split off by refract blocks.
+            intercept_new : *set,int*
+                Set of compact mesh indices of the positions the split beams pass through.
+        '''
+        final_intercept_list = set()
+        intercept_new = set()
+        splits = []
+        for k in range(len(self.source)):
+            result = self.cache.lookup(k, meshgrid)
+            if result is None:
+                result = self.cache_source(k, meshgrid, stride)
+            final_intercept_list |= result[0]
+            splits += result[1]
+            intercept_new |= result[2]
+        return final_intercept_list, splits, intercept_new
+
+    def cache_source(self, k, meshgrid, stride):
+
+        '''
+        The cache source function traces one laser and stores the result in self.cache.
+        **Parameters**
+            k: *int*
+                Which of the lasers to trace.
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+        **Returns**
+            result: *tuple*
+                The intercepts, splits and split beam intercepts as in trajectory, and the bitmask of targets hit.
+        '''
+        reads = {}
+        intercepts, splits, intercept_new, mask = self.source_trajectory(k, meshgrid, stride, reads, self.cache.target_bits)
+        result = (frozenset(intercepts), tuple(splits), frozenset(intercept_new), mask)
+        self.cache.store(k, reads, result)
+        return result
+
+    def target_trajectory(self, meshgrid, stride, target_bits, all_targets):
+
+        '''
+        The target trajectory function only answers which targets the lasers hit, as a bitmask, which is all a solver
+        needs to know about a candidate. It ORs the bit of every target a beam passes into the mask as it steps and stops
+        following beams as soon as every target is hit, and no position sets are built along the way. With a cache the
+        per laser bitmasks come from the cache instead (the cache must have been made with the same target bits).
+        **Parameters**
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+            target_bits: *list,int*
+                The target bits of each compact mesh index (see Board.target_bits).
+            all_targets: *int*
+                Bitmask with every target set.
+        **Returns**
+            mask: *int*
+                Bitmask of the targets hit. Board.missing_targets turns it into the targets still missing.
+        '''
+        mask = 0
+        if self.cache is not None:
+            for k in range(len(self.source)):
+                result = self.cache.lookup(k, meshgrid)
+                if result is None:
+                    result = self.cache_source(k, meshgrid, stride)
+                mask |= result[3]
+                if mask == all_targets:
+                    break
+            return mask
+
+        splits = []
+        if self.prefixes is not None:
+            # The parts of the beams in front of the open spots were traced by precompute, so we carry on from there
+            seen = set(self.prefix_seen)
+            skipped = len(seen)
+            mask = self.prefix_mask
+            beams = self.prefix_entries
+        else:
+            seen = set()
+            skipped = 0
+            beams = [(x, y, vx, vy, True) for (x, y), (vx, vy) in zip(self.source, self.direction)]
+        for x, y, vx, vy, main in beams:
+            if mask == all_targets:
+                break
+            mask = self.laser_prediction(x, y, vx, vy, meshgrid, stride, None, splits, seen, None,
+                                         target_bits, mask, all_targets)
+        k = 0
+        while k < len(splits) and mask != all_targets:
+            (sx, sy, svx, svy) = splits[k]
+            mask = self.laser_prediction(sx, sy, svx, svy, meshgrid, stride, None, splits, seen, None,
+                                         target_bits, mask, all_targets)
+            k += 1
+        self.steps += len(seen) - skipped
+        return mask
+
+    def source_trajectory(self, k, meshgrid, stride, reads=None, target_bits=None):
+
+        '''
+        The source trajectory function traces a single one of the lasers, with all the beams split off it, on its own.
+        **Parameters**
+            k: *int*
+                Which of the lasers to trace.
+            meshgrid: *bytearray*
+                Flat compact mesh from Board.make_mesh or Board.mesh_overlay.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+            reads: *dict*
+                If given, every spot the beams run into is recorded here (index to block code).
+            target_bits: *list,int*
+                If given, the target bits of each compact mesh index (see Board.target_bits).
+        **Returns**
+            intercepts: *set,int*
+                Set of compact mesh indices of the positions the laser passes through.
+            splits: *list,tuple*
+                List of the (x, y, vx, vy) beams split off by refract blocks.
+            intercept_new : *set,int*
+                Set of compact mesh indices of the positions the split beams pass through.
+            mask: *int*
+                Bitmask of the targets hit (0 without target_bits).
+        '''
+        if self.prefixes is not None:
+            # Starting from where the precomputed part in front of the open spots left the beams
+            main_hits, split_hits, prefix_splits, prefix_seen, entries, prefix_mask = self.prefixes[k]
+            intercepts = set(main_hits)
+            intercept_new = set(split_hits)
+            splits = list(prefix_splits)
+            seen = set(prefix_seen)
+            mask = prefix_mask if target_bits is not None else 0
+            for x, y, vx, vy, main in entries:
+                mask = self.laser_prediction(x, y, vx, vy, meshgrid, stride, intercepts if main else intercept_new,
+                                             splits, seen, reads, target_bits, mask)
+            j = len(prefix_splits)
+            skipped = len(prefix_seen)
+        else:
+            (x, y), (vx, vy) = self.source[k], self.direction[k]
+            intercepts = set()
+            intercept_new = set()
+            splits = []
+            seen = set()
+            mask = self.laser_prediction(x, y, vx, vy, meshgrid, stride, intercepts, splits, seen, reads, target_bits)
+            j = 0
+            skipped = 0
+        while j < len(splits):
+            (sx, sy, svx, svy) = splits[j]
+            mask = self.laser_prediction(sx, sy, svx, svy, meshgrid, stride, intercept_new, splits, seen, reads,
+                                         target_bits, mask)
+            j += 1
+        self.steps += len(seen) - skipped
+        return intercepts, splits, intercept_new, mask
+
+    def partial_trajectory(self, meshgrid, stride, target_bits=None):
+
+        '''
+        The partial trajectory function follows every laser (and every beam split off by a refract block) through a compact
+        mesh in which some open spots have not been decided yet. Those spots hold UNDECIDED, and a beam that runs into one
+        stops there because we cannot know what it will do.
+        **Parameters**
+            meshgrid: *bytearray*
+                Flat compact mesh, with UNDECIDED for undecided spots.
+            stride: *int*
+                The number of entries in each row of the compact mesh.
+            target_bits: *list,int*
+                If given, the target bits of each compact mesh index (see Board.target_bits).
+        **Returns**
+            hits: *set,int*
+                Set of compact mesh indices of every position any beam passed through.
+            frontier: *list,int*
+                List of compact mesh indices of the undecided spots that a beam ran into, in the order they were reached.
+            mask: *int*
+                Bitmask of the targets hit (0 without target_bits).
+        '''
+        mask = 0
+        hits = set()
+        frontier = []
+        seen = set()
+        beams = [(x, y, vx, vy) for (x, y), (vx, vy) in zip(self.source, self.direction)]
+
+        # Each beam is followed until it leaves the board, is stopped, or repeats a state some beam was already in
+        steps = 0
+        while beams and steps < self.max_steps:
+            x, y, vx, vy = beams.pop()
+            while (x, y, vx, vy) not in seen and steps < self.max_steps:
+                steps += 1
+                index = (y + 1) * stride + x + 1
+                if meshgrid[index] == OUTSIDE:
+                    break
+                seen.add((x, y, vx, vy))
+                hits.add(index)
+                if target_bits is not None:
+                    mask |= target_bits[index]
+
+                # The block the beam is heading into sits across the edge it is on (left/right or above/below)
+                block_index = index + vy * stride if x & 1 else index + vx
+                block = meshgrid[block_index]
+                if block == UNDECIDED:
+                    if block_index not in frontier:
+                        frontier.append(block_index)
+                    break
+                reflect, transmit = BLOCK_PROPERTIES[block]
+                if not reflect and not transmit:
+                    break
+                if reflect:
+                    if transmit:
+                        beams.append((x + vx, y + vy, vx, vy))
+                    if x & 1:
+                        vy = -vy
+                    else:
+                        vx = -vx
+                x += vx
+                y += vy
+        self.steps += steps
+        return hits, frontier, mask
+
+    def batch_trajectory(self, boards, targets):
+
+        '''
+        The batch trajectory function traces the lasers through many boards at once with NumPy and reports which boards
+        have every target hit. All beams of all boards move one step per loop, so the Python loop runs once per step
+        instead of once per step per board. Only the beams still going are kept, in flat arrays that every step only
+        indexes into tables worked out up front. A beam is dropped once it leaves the board, stops in an opaque block or
+        repeats a position and direction its board already had, so loops always end, and the beams of a board stop as
+        soon as it has every target hit.
+        **Parameters**
+            boards: *numpy.ndarray*
+                Array of shape (N, H, W) of block codes (see BLOCK_CODES), as built by Board.placement_batch.
+            targets: *list,tuple*
+                List of tuples containing the position of the targets.
+        **Returns**
+            solved: *numpy.ndarray*
+                Boolean array of length N that is True for the boards where every target is hit.
+        '''
+        if np is None:
+            raise ImportError("The batch evaluator requires NumPy.")
+        n_boards, height, width = boards.shape
+        stride = 2 * width + 3
+        size = stride * (2 * height + 3)
+
+        # Building the padded compact meshes of every board in one go, one after the other in a single flat array
+        meshes = np.full((n_boards, 2 * height + 3, stride), OUTSIDE, dtype=np.uint8)
+        meshes[:, 1:-1, 1:-1] = EMPTY
+        meshes[:, 2:-2:2, 2:-2:2] = boards
+        meshes = meshes.reshape(-1)
+
+        # Tables over the positions of a mesh, the same for every board: whether a position is on the board, whether a
+        # beam there runs into the block above or below it (odd x) rather than left or right of it, and which target bit
+        # it is. Directions are coded as 2 * (vx > 0) + (vy > 0)
+        columns = np.arange(size) % stride - 1
+        rows = np.arange(size) // stride - 1
+        inside = (columns >= 0) & (columns <= 2 * width) & (rows >= 0) & (rows <= 2 * height)
+        odd = (columns & 1).astype(np.intp)
+        bits = np.zeros(size, dtype=np.int64)
+        for n, (tx, ty) in enumerate(sorted(set(targets))):
+            bits[(ty + 1) * stride + tx + 1] |= 1 << n
+        all_targets = (1 << len(set(targets))) - 1
+        dx = np.array([-1, -1, 1, 1])
+        dy = np.array([-1, 1, -1, 1])
+        move = dx + dy * stride
+        # Where the block a beam runs into is, and which direction bit it flips when it reflects, by direction and odd
+        ahead = np.stack([dx, dy * stride], axis=1)
+        flip = np.array([2, 1])
+
+        # Only the live beams are kept, as flat arrays of their board, position and direction
+        board = np.repeat(np.arange(n_boards, dtype=np.intp), len(self.source))
+        position = np.tile([(sy + 1) * stride + sx + 1 for sx, sy in self.source], n_boards).astype(np.intp)
+        direction = np.tile([2 * (vx > 0) + (vy > 0) for vx, vy in self.direction], n_boards).astype(np.intp)
+        mask = np.zeros(n_boards, dtype=np.int64)
+        # The first beam to reach a position and direction of its board owns it, any later beam there stops
+        owner = np.full(n_boards * size * 4, -1, dtype=np.int32)
+
+        while len(board):
+            # Beams that left the board stop
+            keep = inside[position]
+            board, position, direction = board[keep], position[keep], direction[keep]
+
+            # A beam repeating a position and direction its board already had (or that another beam has this step) stops
+            state = (board * size + position) * 4 + direction
+            keep = owner[state] < 0
+            board, position, direction, state = board[keep], position[keep], direction[keep], state[keep]
+            beam = np.arange(len(board), dtype=np.int32)
+            owner[state] = beam
+            keep = owner[state] == beam
+            board, position, direction = board[keep], position[keep], direction[keep]
+
+            # Marking the targets hit, and stopping the beams of boards that already have them all
+            hit = bits[position] != 0
+            np.bitwise_or.at(mask, board[hit], bits[position[hit]])
+            keep = mask[board] != all_targets
+            board, position, direction = board[keep], position[keep], direction[keep]
+
+            # Looking up the block each beam is heading into and what it does to the beam
+            parity = odd[position]
+            block = meshes[board * size + position + ahead[direction, parity]]
+            split = block == REFRACT
+            through = (board[split], position[split] + move[direction[split]], direction[split])
+            keep = block != OPAQUE
+            board, position, direction = board[keep], position[keep], direction[keep]
+            parity, block = parity[keep], block[keep]
+            direction = np.where((block == REFLECT) | (block == REFRACT), direction ^ flip[parity], direction)
+            position = position + move[direction]
+
+            # The beams split off by refract blocks carry straight on, in the direction the beam had before the block
+            if len(through[0]):
+                board = np.concatenate([board, through[0]])
+                position = np.concatenate([position, through[1]])
+                direction = np.concatenate([direction, through[2]])
+
+        return mask == all_targets
+
+
+class BoardState:
+
+    '''
+    The board state class keeps one candidate board together with the traced path of each of its lasers, so that a
+    small change (moving a block, swapping two blocks) only re-traces the lasers that ran into one of the changed spots.
+    Every other laser keeps what it had, which makes trying many small changes much cheaper than building and tracing a
+    new board every time. This is what local search solvers build on.
+    '''
+
+    def __init__(self, board, laser, placement):
+
+        '''
+        This function places a layout on the board and traces every laser once.
+        **Parameters**
+            board: *Board*
+                The board of the puzzle.
+            laser: *Laser*
+                The lasers of the puzzle.
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs describing the blocks to place.
+        '''
+        self.board = board
+        self.laser = laser
+        self.mesh = board.mesh_overlay(placement)
+        self.placement = dict(placement)
+        self.retraced = 0
+        self.traces = [self.trace(k) for k in range(len(laser.source))]
+
+    def trace(self, k):
+
+        '''
+        This function traces one laser on the current board.
+        **Parameters**
+            k: *int*
+                Which of the lasers to trace.
+        **Returns**
+            trace: *tuple*
+                The set of compact mesh indices the laser passes through, the set of spots it ran into and the bitmask
+                of the targets it hits.
+        '''
+        reads = {}
+        intercepts, splits, intercept_new, mask = self.laser.source_trajectory(k, self.mesh, self.board.stride, reads,
+                                                                             self.board.target_bits)
+        return intercepts | intercept_new, frozenset(reads), mask
+
+    def hits(self):
+
+        '''
+        This function gives every position any laser passes through on the current board.
+        **Returns**
+            hits: *set,int*
+                Set of compact mesh indices.
+        '''
+        hits = set()
+        for intercepts, touched, mask in self.traces:
+            hits |= intercepts
+        return hits
+
+    def mask(self):
+
+        '''
+        This function gives the bitmask of the targets hit on the current board.
+        **Returns**
+            mask: *int*
+                Bitmask of the targets hit. Board.missing_targets turns it into the targets still missing.
+        '''
+        mask = 0
+        for intercepts, touched, laser_mask in self.traces:
+            mask |= laser_mask
+        return mask
+
+    def apply(self, changes):
+
+        '''
+        This function changes blocks on the board and re-traces only the lasers that ran into a changed spot.
+        **Parameters**
+            changes: *list,tuple*
+                A list of ((i, j), block_type) pairs, using 'o' to empty a spot.
+        '''
+        changed = set()
+        for (i, j), block_type in changes:
+            index = self.board.cell_index(i, j)
+            if self.mesh[index] != BLOCK_CODES[block_type]:
+                self.mesh[index] = BLOCK_CODES[block_type]
+                changed.add(index)
+            if block_type == 'o':
+                self.placement.pop((i, j), None)
+            else:
+                self.placement[(i, j)] = block_type
+        for k, (intercepts, touched, mask) in enumerate(self.traces):
+            if not touched.isdisjoint(changed):
+                self.traces[k] = self.trace(k)
+                self.retraced += 1
+
+    def move(self, source, target):
+
+        '''
+        This function moves the block at one spot to an empty spot.
+        **Parameters**
+            source: *tuple*
+                The (i, j) spot the block is taken from.
+            target: *tuple*
+                The empty (i, j) spot the block goes to.
+        '''
+        self.apply([(source, 'o'), (target, self.placement[source])])
+
+    def swap(self, first, second):
+
+        '''
+        This function swaps the types of two placed blocks.
+        **Parameters**
+            first: *tuple*
+                The (i, j) spot of one of the blocks.
+            second: *tuple*
+                The (i, j) spot of the other block.
+        '''
+        self.apply([(first, self.placement[second]), (second, self.placement[first])])
+
+
+class SolverStats:
+
+    '''
+    The solver stats class collects what a solver is doing while it runs: how many candidates it traced, how many of
+    those were layouts it had already tried, how many beam steps that took, how well the trace cache did, and how the
+    time splits between parsing the puzzle, building boards and tracing lasers. Pass one to final_solution_generator
+    (or any of the solvers) to have it filled in. An optional progress function is called with the stats every interval
+    seconds, which is enough to show throughput and an ETA while a long solve runs. Solvers given no stats do none of
+    this bookkeeping.
+    '''
+
+    def __init__(self, progress=None, interval=1.0):
+
+        '''
+        This function initializes empty stats.
+        **Parameters**
+            progress: *function*
+                Called with the stats object every interval seconds while a solver runs, or None.
+            interval: *float*
+                Seconds between two calls of progress.
+        '''
+        self.progress = progress
+        self.interval = interval
+        self.mode = None
+        self.total = None
+        self.bound = False
+        self.candidates = 0
+        self.duplicates = 0
+        self.parse_time = 0.0
+        self.build_time = 0.0
+        self.trace_time = 0.0
+        self.start = time.perf_counter()
+        self.stop = None
+        self.laser = None
+        self.layouts = None
+        self.next_report = self.start + interval
+
+    def begin(self, mode, total, laser, duplicates=False, bound=False):
+
+        '''
+        This function is called by a solver once it has parsed the puzzle and is about to test candidates.
+        **Parameters**
+            mode: *str*
+                The solver mode.
+            total: *int*
+                The most candidates the solver can test (maxiter or the number of layouts), or None if unknown.
+            laser: *Laser*
+                The laser the solver traces with, whose step counter and trace cache the stats read.
+            duplicates: *bool*
+                Whether to remember every layout to count the repeated ones. Only the random mode can repeat layouts.
+            bound: *bool*
+                Whether total is only an upper bound, as for the searches through canonical layouts: they skip layouts
+                the lasers cannot tell apart, and how many are left is not known up front. The ETA is then a bound too.
+        '''
+        self.mode = mode
+        self.total = total
+        self.bound = bound
+        self.laser = laser
+        if duplicates:
+            self.layouts = set()
+
+    def record(self, build_start, trace_start, candidates=1, placement=None):
+
+        '''
+        This function is called by a solver after it traced a candidate (or a whole batch of them).
+        **Parameters**
+            build_start: *float*
+                time.perf_counter() from before the board was built.
+            trace_start: *float*
+                time.perf_counter() from before the lasers were traced.
+            candidates: *int*
+                The number of candidates traced.
+            placement: *list,tuple*
+                The layout traced, used to count repeats when begin was asked to.
+        '''
+        now = time.perf_counter()
+        self.build_time += trace_start - build_start
+        self.trace_time += now - trace_start
+        self.candidates += candidates
+        if self.layouts is not None and placement is not None:
+            layout = tuple(sorted(placement))
+            if layout in self.layouts:
+                self.duplicates += 1
+            else:
+                self.layouts.add(layout)
+        if self.progress is not None and now >= self.next_report:
+            self.next_report = now + self.interval
+            self.progress(self)
+
+    def finish(self):
+
+        '''
+        This function is called by a solver once it is done, which stops the clock.
+        '''
+        self.stop = time.perf_counter()
+        self.layouts = None
+
+    @property
+    def elapsed(self):
+        # Seconds since the stats were made, up to when the solver finished
+        return (self.stop if self.stop is not None else time.perf_counter()) - self.start
+
+    @property
+    def throughput(self):
+        # Candidates traced per second so far
+        elapsed = self.elapsed
+        return self.candidates / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        # Seconds left until the solver runs out of candidates at the current throughput (at most, when the total is a
+        # bound), or None if unknown
+        if self.total is None or self.throughput == 0:
+            return None
+        return max(self.total - self.candidates, 0) / self.throughput
+
+    @property
+    def duplicate_rate(self):
+        # Fraction of the traced candidates that were layouts already tried
+        return self.duplicates / self.candidates if self.candidates else 0.0
+
+    @property
+    def beam_steps(self):
+        # Beam steps the laser followed (the batch mode traces with NumPy and does not count them)
+        return self.laser.steps if self.laser is not None else 0
+
+    @property
+    def steps_per_candidate(self):
+        return self.beam_steps / self.candidates if self.candidates else 0.0
+
+    @property
+    def cache_hits(self):
+        cache = self.laser.cache if self.laser is not None else None
+        return cache.hits if cache is not None else 0
+
+    @property
+    def cache_misses(self):
+        cache = self.laser.cache if self.laser is not None else None
+        return cache.misses if cache is not None else 0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def as_dict(self):
+
+        '''
+        This function gives the stats as a plain dictionary, for reports and logging.
+        **Returns**
+            stats: *dict*
+                Every counter, rate and timing of the stats.
+        '''
+        return {'mode': self.mode, 'candidates': self.candidates, 'total': self.total, 'bound': self.bound,
+                'duplicates': self.duplicates, 'duplicate_rate': self.duplicate_rate,
+                'beam_steps': self.beam_steps, 'steps_per_candidate': self.steps_per_candidate,
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+                'cache_hit_rate': self.cache_hit_rate, 'parse_time': self.parse_time,
+                'build_time': self.build_time, 'trace_time': self.trace_time, 'elapsed': self.elapsed,
+                'throughput': self.throughput, 'eta': self.eta}
+
+
+def print_progress(stats):
+
+    '''
+    The print progress function is a ready made progress function for SolverStats that prints one line to stderr.
+    **Parameters**
+        stats: *SolverStats*
+            The stats of the running solver.
+    '''
+    # A total that is only a bound is shown as such, so 'ETA <= 10s' means the search is done within 10 seconds
+    at_most = '<= ' if stats.bound else ''
+    eta = '?' if stats.eta is None else '{}{:.0f}s'.format(at_most, stats.eta)
+    total = '' if stats.total is None else '/{}{}'.format(at_most, stats.total)
+    print('{} candidates{}  {:.0f}/s  ETA {}  cache {:.0%}  {:.1f} steps/candidate'.format(
+        stats.candidates, total, stats.throughput, eta, stats.cache_hit_rate, stats.steps_per_candidate),
+        file=sys.stderr)
+
+
+class SolutionStore:
+
+    '''
+    The solution store keeps solved puzzles in a SQLite file, so solving the same puzzle again is only a lookup. Puzzles
+    are looked up by Puzzle.key, and a stored solution is checked with a single Laser.trajectory before it is handed
+    back, so a damaged or stale entry is dropped instead of returned. Entries from another ENGINE_VERSION are removed
+    when the store is opened, and once there are more than maxsize entries the ones used longest ago are removed.
+    '''
+
+    def __init__(self, path, maxsize=10000):
+
+        '''
+        This function opens (or creates) a store.
+        **Parameters**
+            path: *str*
+                The SQLite file of the store.
+            maxsize: *int*
+                The most solutions kept.
+        '''
+        if sqlite3 is None:
+            raise ImportError("The solution store requires the sqlite3 module.")
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Batch workers share the file, so a writer waits for another one instead of failing right away
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, engine TEXT, '
+                                    'placement TEXT, used REAL)')
+            self.connection.execute('DELETE FROM solutions WHERE engine != ?', (ENGINE_VERSION,))
+
+    def lookup(self, puzzle):
+
+        '''
+        This function looks for a stored solution of a puzzle and checks that it still solves it.
+        **Parameters**
+            puzzle: *Puzzle*
+                The puzzle to look for.
+        **Returns**
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs that solves the puzzle, or None if there is none stored.
+        '''
+        key = puzzle.key()
+        row = self.connection.execute('SELECT placement FROM solutions WHERE key = ? AND engine = ?',
+                                      (key, ENGINE_VERSION)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        placement = [((i, j), block_type) for i, j, block_type in json.loads(row[0])]
+        if not self.verify(puzzle, placement):
+            with self.connection:
+                self.connection.execute('DELETE FROM solutions WHERE key = ?', (key,))
+            self.misses += 1
+            return None
+        with self.connection:
+            self.connection.execute('UPDATE solutions SET used = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        return placement
+
+    def verify(self, puzzle, placement):
+
+        '''
+        This function checks a layout against a puzzle: it must use exactly the inventory on open spots, and a single
+        trace of the lasers must pass through every target.
+        **Parameters**
+            puzzle: *Puzzle*
+                The puzzle the layout is for.
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs.
+        **Returns**
+            valid: *bool*
+                Whether the layout solves the puzzle.
+        '''
+        spots = [spot for spot, block_type in placement]
+        if len(set(spots)) != len(spots) or not set(spots) <= set(puzzle.sample_space):
+            return False
+        used = {'A': 0, 'B': 0, 'C': 0}
+        for spot, block_type in placement:
+            if block_type not in used:
+                return False
+            used[block_type] += 1
+        if used != puzzle.inventory():
+            return False
+        B = Board(puzzle.grid, puzzle.laser_start, puzzle.laser_path, puzzle.targets)
+        L = Laser(puzzle.laser_start, puzzle.laser_path)
+        intercepts, splits, intercept_new = L.trajectory(puzzle.laser_path, puzzle.grid, B.mesh_overlay(placement))
+        return all(B.mesh_index(x, y) in intercepts or B.mesh_index(x, y) in intercept_new for x, y in puzzle.targets)
+
+    def save(self, puzzle, placement):
+
+        '''
+        This function stores the solution of a puzzle, and evicts the entries used longest ago beyond maxsize.
         **Parameters**
-            path: *list,tuples* 
-                List of tuples containing the direction of the laser(s).
-            intercepts: *list,tuples* 
-                List of tuples containing the positions the laser intercepts after any interactions with blocks
-            grid: *list,list,str*
-                Nested list of strings that visualizes/contextualizes the base game state.
-            meshgrid: *list, list, str*
-                Nested list of strings that visualizes/contextualizes the laser board state better.
-            path_1: *list,tuples* 
-                List of tuples containing the direction of the laser(s) after any changes.
-        **Returns**
-            path: *list,tuples* 
-                List of tuples containing the direction of the laser(s).
-            intercepts: *list,tuples* 
-                List of tuples containing the positions the laser intercepts after any interactions with blocks
-            path_1: *list,tuples* 
-                List of tuples containing the direction of the laser(s) after any changes.
-            intercept_new: *list,tuples* 
-                List of tuples containing the positions the laser intercepts after any interactions with blocks.
-        '''
-        # Setting up all the necessary variables and empty lists to be able to set information accessibly later
-        # We want to colect the direction and the starting position of the lasers
-        # We also want to set variables for the max boundaries of the grid so we can ensure we are within the puzzle scheme
-        nearby_list = []
-        transition_list = []
-        (path_x, path_y) = path[-1]
-        (int_x, int_y) = intercepts[-1]
-        n_direct = [(0, 1),(0, -1),(-1, 0),(1, 0)]
-        x_max = 2 * len(grid[0]) + 1
-        y_max = 2 * len(grid) + 1
-
-        # Can simplify the return feature if we know we are at 0,0 within the puzzle scheme
-        if (path_x, path_y) == (0, 0):
-            return path, intercepts, path_1, intercept_new
-
-        # Loop to unpack the maximum values for ex and ey to know where the laser is going
-        for dx, dy in n_direct:
-            ex, ey = int_x + dx, int_y + dy
-
-            # Quick check to ensure we are within the range we want to be in
-            if 0 < ex < x_max and 0 < ey < y_max:
-                delta_x = ex - int_x
-                delta_y = ey - int_y
-
-                # If we run into a reflect block, we want to reflect the laser
-                # We are checking if the meshgrid is an A just to show there would be other ways to check the block properties
-                if meshgrid[ey][ex] == 'A':
-                    new_path_x = path_x * (1 if delta_x == 0 else -1)
-                    new_path_y = path_y * (1 if delta_y == 0 else -1)
-                    nearby_list.append((new_path_x, new_path_y))
-
-                # Now we are using the Blocks class and checking if it has False, False for the reflection and transmitting properties
-                # It needs to check where it is on the board and then correctly update to where the next location will be
-                elif Blocks(ex,ey).prop(meshgrid) == (False,False):
-                    if delta_x == path_x or delta_y == path_y:
-                        new_path_x, new_path_y = path_x, path_y
-                    else:
-                        new_path_x, new_path_y = path_x * 1, path_y * 1
-                    nearby_list.append((new_path_x, new_path_y))
-
-                # Now we are using the Blocks class and checking if it has True, True for the reflection and transmitting properties
-                # It needs to check where it is on the board and then correctly update to where the next location will be
-                elif Blocks(ex,ey).prop(meshgrid) == (True,True):
-                    if delta_x == path_x or delta_y == path_y:
-                        new_path_x = path_x * (1 if delta_x == 0 else -1)
-                        new_path_y = path_y * (1 if delta_y == 0 else -1)
-                        old_path_x, old_path_y = path_x, path_y
-                        transition_list.append((old_path_x, old_path_y))
-                        nearby_list.append((new_path_x, new_path_y))
-                    else:
-                        new_path_x, new_path_y = path_x * 1, path_y * 1
-                        nearby_list.append((new_path_x, new_path_y))
+            puzzle: *Puzzle*
+                The solved puzzle.
+            placement: *list,tuple*
+                A list of ((i, j), block_type) pairs that solves the puzzle.
+        '''
+        blocks = json.dumps(sorted([i, j, block_type] for (i, j), block_type in placement))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)',
+                                    (puzzle.key(), ENGINE_VERSION, blocks, time.time()))
+            self.connection.execute('DELETE FROM solutions WHERE key IN (SELECT key FROM solutions ORDER BY used DESC '
+                                    'LIMIT -1 OFFSET ?)', (self.maxsize,))
 
-        # Depending on what list we have added to, we want to append to the list for the new intercepted points
-        # We do this for both coordinates as path and intercepts is useful/required information
-        if nearby_list:
-            path.append(nearby_list[-1])
-        else:
-            path.append((path_x, path_y))
+    def close(self):
+        self.connection.close()
 
-        if transition_list:
-            path_1.append(transition_list[-1])
-            intercept_new.append((int_x, int_y))
 
-        int_x += path[-1][0]
-        int_y += path[-1][1]
-        intercepts.append((int_x, int_y))
+class Solution(namedtuple('Solution', ['grid', 'placement', 'iterations', 'candidates', 'beams', 'stats'])):
 
-        return path, intercepts, path_1, intercept_new
+    '''
+    The solution class is what the solvers return. Nothing is written anywhere until write is called, so many puzzles
+    can be solved at once (in threads, processes or a service) without their outputs getting in each other's way.
+    Its fields are:
+        grid: *list,list,str*
+            Nested list of strings of the solved grid, or None if no solution was found.
+        placement: *tuple,tuple*
+            Tuple of ((i, j), block_type) pairs of the blocks placed, or None.
+        iterations: *int*
+            The number of iterations the solver went through (layouts, batches, shards, search steps or changes).
+        candidates: *int*
+            The number of boards whose lasers were traced.
+        beams: *tuple,tuple*
+            For every laser, the sorted (x, y) positions it and the beams split off it pass through, or None.
+        stats: *SolverStats*
+            The stats the solver filled in, or None.
+    '''
+    __slots__ = ()
 
+    @property
+    def solved(self):
+        return self.grid is not None
+
+    def text(self):
 
-    def trajectory(self, path, grid, meshgrid):
-        
         '''
-        The trajectory function attempts to predict the trajectory of the laser using the laser_prediction function for
-        additional information.
-        **Parameters**
-            path: *list,tuples* 
-                List of tuples containing the direction of the laser(s).
-            grid: *list,list,str*
-                Nested list of strings that visualizes/contextualizes the base game state.
-            meshgrid: *list, list, str*
-                Nested list of strings that visualizes/contextualizes the laser board state better.
+        This function gives the solution in the same format as the solution file.
         **Returns**
-            final_intercept_list: *list,tuples*
-                List of tuples containing the final positions the laser intercepts after any interactions with blocks.
-            path: *list,tuples* 
-                List of tuples containing the direction of the laser(s).
-            intercept_new : *list,tuples* 
-                List of tuples containing the positions the laser intercepts after any interactions with blocks.
+            text: *str*
+                One line per row of the grid with a tab after every block.
         '''
-        # Setting the variables to be able to see the intercepted points and the path of the laser
-        # We want to take the source and direction from the initialization step and append to these variables
-        intercepts = []
-        path = []
-        for i in range(len(self.source)):
-            intercepts.append([self.source[i]])
-            path.append([self.direction[i]])
-
-        # Now, we want to update these with the changes that we get from placing things on the grid and updating the effect
-        # it has on the laser_prediction function which is extremely useful for finding a possible solution
-        path_1 = []
-        intercept_new = []
-        
-        # We will loop through the length of our path and see what changes occur with blocks in the path or not
-        for k in range(len(path)) :
-            
-            # If one of the intercepts is nearby a block, we want it to be able to change directions as intended
-            # This is good to check initially as it influences the rest of the program
-            if len(intercepts[k]) == 1:
-                path[k], intercepts[k], path_1, intercept_new = self.laser_prediction(path[k], intercepts[k], grid, meshgrid, path_1, intercept_new)
-
-            # Once we get past the start, we want to continue this trend until we reach the bounds of our puzzle
-            # The bounds of the puzzle will indicate we can stop going
-            while intercepts[k][-1][0] != 0 and intercepts[k][-1][0] < len(meshgrid[0])-1 and intercepts[k][-1][1] != 0 and intercepts[k][-1][1] < len(meshgrid)-1:
-                if path[k][-1] != (0,0):
-                    path[k], intercepts[k], path_1, intercept_new = self.laser_prediction(path[k], intercepts[k], grid, meshgrid, path_1, intercept_new)
-                else:
-                    break
-                    
-            # This check is what is going to be breaking the laser path into multiple in the situation that it runs into a
-            # block that splits it. This will be important to find solutions as most of the time we will likely need to do this
-            if len(path_1) != 0:
-                path_0 = []
-                intercept_0 = []
-                (dx,dy) = path_1[-1]
-                (cx, cy) = intercept_new[-1]
-                nx = cx + dx
-                ny = cy + dy
-                intercept_new.append((nx,ny))
-                while intercept_new[-1][0] != 0 and intercept_new[-1][0] < len(meshgrid[0])-1 and intercept_new[-1][1] != 0 and intercept_new[-1][1] < len(meshgrid)-1:
-                    if path_1[-1] != (0,0):
-                        path_1, intercept_new, path_0, intercept_0 = self.laser_prediction(path_1, intercept_new, grid, meshgrid, path_0, intercept_0)
-                    else:
-                        break
-                        
-        # Now that we are out of the path, we want to return to a final intercept list that isn't double counting
-        # as we have multiple paths now possibly and don't want to be multi-counting them
-        final_intercept_list = []
-        for sublist in intercepts:
-            for item in sublist:
-                final_intercept_list.append(item)
-        return final_intercept_list, path, intercept_new
+        return ''.join(''.join(block + '\t' for block in row) + '\n' for row in self.grid)
 
-    
-def puzzle_generator(mesh):
+    def write(self, output='solution.bff'):
+
+        '''
+        This function writes the solution out like puzzle_generator does.
+        **Parameters**
+            output: *str or file*
+                The name of the file to write to, or an open text file (or anything else with a write method).
+        '''
+        write_grid(self.grid, output)
+
+
+def write_grid(grid, output):
+
+    '''
+    The write grid function writes a solved grid in the solution file format, one line per row with a tab after every
+    block.
+    **Parameters**
+        grid: *list,list,str*
+            Nested list of strings of the solved grid.
+        output: *str or file*
+            The name of the file to write to, or an open text file (or anything else with a write method).
+    '''
+    if hasattr(output, 'write'):
+        for row in grid:
+            for block in row:
+                output.write(block)
+                output.write('\t')
+            output.write('\n')
+        return
+    with open(output, 'w') as file:
+        write_grid(grid, file)
+
+
+def puzzle_generator(mesh, output='solution.bff'):
     
     '''
     The puzzle generator function inputs the solution mesh grid and outputs a readable .bff readable in a similar format
@@ -516,76 +2240,1241 @@ def puzzle_generator(mesh):
         mesh: *list, list, str*
             Nested list of strings that visualizes/contextualizes the final laser board state including positions 
             of blocks, and the points the laser passes.
+        output: *str or file*
+            The name of the file the solution is written to, or an open text file.
     **Output**
         solution.bff: *file*
             A .bff file that contains the solution to the puzzle in a similar format to the given .bff files.
     '''
     # We want to set our solution set to nothing so we can fill it up with the actual solution
     # We also set the the width to get the solution to be the correct size of the board we want
-    # Then we just write the solution into the file by writing it in
-    # And then close up shop, and get out of the file type
+    # Then we just write the solution into the file with write_grid
     solution = []
     for j in range(1,len(mesh),2):
         for i in range(1, len(mesh[0]),2):
             solution.append(mesh[j][i])
     width = int((len(mesh[0])-1)/2)
     solution = [solution[x:x+width] for x in range(0, len(solution), width)]
-    file = open('solution.bff', 'w')
-    for i in solution:
-        for j in i:
-            file.write(j)
-            file.write('\t')
-        file.write('\n')
-    file.close()
+    write_grid(solution, output)
     print("Solution found!")
-    
-def final_solution_generator(puzzle, maxiter=50000):
+
+
+def _solved(B, P, placement, iterations, candidates, stats):
+    # Placing the solution on the grid of the puzzle and tracing it once more to give the path of every laser
+    L = Laser(P.laser_start, P.laser_path)
+    mesh = B.mesh_overlay(placement)
+    beams = []
+    for k in range(len(P.laser_start)):
+        intercepts, splits, intercept_new, mask = L.source_trajectory(k, mesh, B.stride)
+        beams.append(tuple(sorted((index % B.stride - 1, index // B.stride - 1) for index in intercepts | intercept_new)))
+    blocks = tuple(sorted((spot, block_type) for spot, block_type in placement if block_type != 'o'))
+    return Solution(B.overlay(P.grid, placement), blocks, iterations, candidates, tuple(beams), stats)
+
+
+def _load(puzzle, stats):
+    # Parsing the puzzle and building its board, timing both for the stats if there are any
+    start = time.perf_counter()
+    P = puzzle if isinstance(puzzle, Puzzle) else Puzzle.from_file(puzzle)
+    parsed = time.perf_counter()
+    B = Board(P.grid, P.laser_start, P.laser_path, P.targets)
+    if stats is not None:
+        stats.parse_time += parsed - start
+        stats.build_time += time.perf_counter() - parsed
+    return P, B
+
+
+def _no_solution(stats):
+    # A puzzle with a target no layout can get a laser to is given up on before testing anything
+    if stats is not None:
+        stats.finish()
+    return Solution(None, None, 0, 0, None, stats)
+
+
+def _fixed_laser(B, P, cache=None):
+    # The lasers of a puzzle with the part of every beam in front of the open spots traced once up front
+    L = Laser(P.laser_start, P.laser_path, cache=cache)
+    L.precompute(B.mesh_overlay([(spot, '?') for spot in P.sample_space]), B.stride, B.target_bits)
+    return L
+
+
+def _cached_laser(B, P):
+    # The lasers of a puzzle with a trace cache over its open spots, as the solvers that test whole layouts use them
+    return _fixed_laser(B, P, TraceCache([B.cell_index(i, j) for i, j in P.sample_space], B.target_bits))
+
+
+def final_solution_generator(puzzle, maxiter=50000, mode='random', workers=1, output='solution.bff', stats=None,
+                             time_budget=None, seed=None, store=None):
 
     '''
     The final solution generator function is what we want to run to actually find the solution for the puzzle and then
     generate the solution file using the puzzle_generator function. This is where we can also set max iterations of the code
     to not let it run for that long.
     **Parameters**
-        puzzle: *str*
-            The puzzle file that will we are trying to find a solution for.
+        puzzle: *str or Puzzle*
+            The puzzle file that will we are trying to find a solution for, or the already parsed puzzle. Every
+            solver below takes either.
         maxiter: *int*
             The longest allowed of iteration steps we are willing to wait before breaking out of the code. A found solution
-            will premptively break it out of the loop anyway.
+            will premptively break it out of the loop anyway. Only used by the random and anneal modes.
+        mode: *str*
+            'random' draws random layouts until one works or maxiter runs out. 'exhaustive' tests every distinct layout
+            exactly once, so it always terminates and can tell us for certain that a puzzle has no solution.
+            'backtrack' only places blocks where a beam actually reaches and prunes dead ends early.
+            'batch' tests the same layouts as 'exhaustive' but thousands at a time with NumPy.
+            'anneal' moves and swaps blocks of a random layout, guided by how many targets it hits.
+        workers: *int*
+            Number of processes the exhaustive mode splits its layouts across. The default of 1 stays in this process, and
+            more than 1 with any other mode raises a ValueError.
+        output: *str or file*
+            The name of the file the solution is written to, or an open text file. With None nothing is written or
+            printed, which is what callers that only want the returned Solution should pass. With sys.stdout the
+            message saying whether a solution was found goes to sys.stderr instead.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+        time_budget: *float*
+            Seconds the anneal mode may search for, or None for no limit besides maxiter.
+        seed: *int*
+            Seed of the random number generator of the anneal mode, for repeatable runs.
+        store: *SolutionStore*
+            Optional store of solved puzzles. A stored solution is returned without searching (with 0 iterations and
+            the 1 candidate traced to check it), and a newly found one is saved to it.
+    **Returns**
+        solution: *Solution*
+            The solved grid and layout (None if no solution was found), the number of iterations the solver went
+            through, the number of boards whose lasers were traced, the path of every laser and the stats.
+    **Raises**
+        ValueError
+            For an unknown mode, or more than 1 worker with a mode other than 'exhaustive'.
     **Output**
         solution.bff: *file*
             A .bff file that contains the solution to the puzzle in a similar format to the given .bff files.
     '''
-    # We want to loop through until we find a solution using the number of iterations we have previously allowed
-    # Then we activate all of our classes to get all the required information that will be used by puzzle_generator
-    # We specifically need to set the target points as part of the final set
-    # This is what we are checking as if we can hit every target point within a current run by looking at the 
-    # intercept_new list, then we have 'accidentally' found a solution and can break out of the loop
-    # It's honestly a pretty cool way of doing this, even though it's extremely basic
+    # Only the exhaustive search can be split across processes, and quietly running the others in one process would hide
+    # that the workers asked for are not used
+    if workers > 1 and mode != 'exhaustive':
+        raise ValueError("The {} mode runs in a single process, only the exhaustive mode takes workers".format(mode))
+    if store is not None:
+        P = puzzle if isinstance(puzzle, Puzzle) else Puzzle.from_file(puzzle)
+        placement = store.lookup(P)
+        if placement is not None:
+            result = _solved(Board(P.grid, P.laser_start, P.laser_path, P.targets), P, placement, 0, 1, stats)
+        else:
+            result = final_solution_generator(puzzle, maxiter, mode, workers, None, stats, time_budget, seed)
+            if result.solved:
+                store.save(P, result.placement)
+    elif mode == 'random':
+        result = random_solution_generator(puzzle, maxiter, stats)
+    elif mode == 'exhaustive' and workers > 1:
+        result = parallel_solution_generator(puzzle, workers, stats)
+    elif mode == 'exhaustive':
+        result = exhaustive_solution_generator(puzzle, stats)
+    elif mode == 'backtrack':
+        result = backtracking_solution_generator(puzzle, stats)
+    elif mode == 'batch':
+        result = batch_solution_generator(puzzle, stats=stats)
+    elif mode == 'anneal':
+        result = annealing_solution_generator(puzzle, maxiter, time_budget, seed, stats)
+    else:
+        raise ValueError("Unknown solver mode: {}".format(mode))
+
+    # Writing the solution out is the only thing done with output, the solvers themselves never touch a file
+    # The messages go to stderr when the solution itself goes to stdout, so it can be piped on as a clean .bff file
+    if output is not None:
+        messages = sys.stderr if output is sys.stdout else sys.stdout
+        if result.solved:
+            result.write(output)
+            print("Solution found!", file=messages)
+        elif mode in ['random', 'anneal']:
+            print('No solution found within range of iterations.', file=messages)
+        else:
+            print('No solution exists for this puzzle.', file=messages)
+    return result
+
+
+def random_solution_generator(puzzle, maxiter=50000, stats=None):
+
+    '''
+    The random solution generator draws random layouts until one of them works or maxiter runs out. The puzzle is
+    parsed a single time and everything that does not change between candidates is built up front, so each candidate
+    is only a copy of the compact mesh with the randomly drawn blocks written into it.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        maxiter: *int*
+            The most layouts drawn before giving up.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator, with the number of layouts drawn as the iterations.
+    '''
+    # We check if we can hit every target point within a current run by looking at the intercepts, and if so we have
+    # 'accidentally' found a solution and can break out of the loop
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    L = _cached_laser(B, P)
+    if stats is not None:
+        stats.begin('random', maxiter, L, duplicates=True)
     for i in range(maxiter):
-        G = Game(puzzle)
-        G.database()
-        B = Board(G.grid,G.laser_start, G.laser_path,G.targets)
-        mesh_board = B.sample_board(B.sample_function(G.grid), G.blocks, G.grid)
-        mesh = B.make_board(mesh_board)
-        L = Laser(G.laser_start,G.laser_path)
-        intcp, pth, intercept_new = L.trajectory(G.laser_path,G.grid, mesh)
-        final_set = G.targets
-        total_intcp = intcp + list(intercept_new)
-        if all(x in total_intcp for x in final_set):
-            puzzle_generator(mesh)
+        if stats is not None:
+            build_start = time.perf_counter()
+        placement = B.sample_placement(P.sample_space, P.inventory())
+        mesh = B.mesh_overlay(placement)
+        if stats is not None:
+            trace_start = time.perf_counter()
+        mask = L.target_trajectory(mesh, B.stride, B.target_bits, B.all_targets)
+        if stats is not None:
+            stats.record(build_start, trace_start, placement=placement)
+        if mask == B.all_targets:
+            if stats is not None:
+                stats.finish()
+            return _solved(B, P, placement, i + 1, i + 1, stats)
+    if stats is not None:
+        stats.finish()
+    return Solution(None, None, maxiter, maxiter, None, stats)
+
+
+def exhaustive_solution_generator(puzzle, stats=None):
+
+    '''
+    The exhaustive solution generator walks through every distinct layout of the inventory over the open spots in a fixed
+    order and stops at the first one where the laser passes through every target. Unlike the random search it never
+    tests the same layout twice, so its worst case is bounded and running out of layouts means the puzzle is unsolvable.
+    Layouts that only differ in spots no beam runs into are only tested once (see Board.canonical_placements).
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator.
+    '''
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    L = _cached_laser(B, P)
+    if stats is not None:
+        stats.begin('exhaustive', B.layout_count(P.sample_space, P.inventory()), L, bound=True)
+
+    # Only one layout of every set the lasers cannot tell apart is tested (see Board.canonical_placements)
+    # Every candidate is a fresh copy of the compact mesh so that placements never leak into the next layout
+    count = 0
+    for placement in B.canonical_placements(P.sample_space, P.inventory()):
+        count += 1
+        if stats is not None:
+            build_start = time.perf_counter()
+        mesh = B.mesh_overlay(placement)
+        if stats is not None:
+            trace_start = time.perf_counter()
+        mask = L.target_trajectory(mesh, B.stride, B.target_bits, B.all_targets)
+        if stats is not None:
+            stats.record(build_start, trace_start)
+        if mask == B.all_targets:
+            if stats is not None:
+                stats.finish()
+            return _solved(B, P, placement, count, count, stats)
+    if stats is not None:
+        stats.finish()
+    return Solution(None, None, count, count, None, stats)
+
+
+def batch_solution_generator(puzzle, batch_size=4096, stats=None, first_batch=16, scalar_batch=128):
+
+    '''
+    The batch solution generator walks through the same layouts as the exhaustive solution generator, but hands them to
+    Laser.batch_trajectory in batches so the lasers of a whole batch are traced together with NumPy. The batches start
+    small and double in size, so a puzzle solved within its first few layouts does not wait for thousands of them to be
+    listed first, and batches too small for NumPy to pay off are traced one layout at a time like the exhaustive search.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        batch_size: *int*
+            The largest number of layouts traced together.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+        first_batch: *int*
+            The number of layouts in the first batch.
+        scalar_batch: *int*
+            Batches of fewer layouts than this are traced without NumPy.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator.
+    **Raises**
+        ImportError
+            When NumPy is not installed.
+    '''
+    if np is None:
+        raise ImportError("The batch evaluator requires NumPy.")
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    L = Laser(P.laser_start, P.laser_path)
+    if stats is not None:
+        stats.begin('batch', B.layout_count(P.sample_space, P.inventory()), L, bound=True)
+    placements = B.canonical_placements(P.sample_space, P.inventory())
+    batches = 0
+    count = 0
+    size = min(first_batch, batch_size)
+    while True:
+        build_start = time.perf_counter()
+        batch = list(itertools.islice(placements, size))
+        if not batch:
             break
-    if not all(x in total_intcp for x in final_set) == True:
-        print('No solution found within range of iterations.')
-        
+        size = min(2 * size, batch_size)
+        batches += 1
+        count += len(batch)
+        if len(batch) < scalar_batch:
+            trace_start = time.perf_counter()
+            solved = [index for index, placement in enumerate(batch)
+                      if L.target_trajectory(B.mesh_overlay(placement), B.stride, B.target_bits, B.all_targets)
+                      == B.all_targets]
+        else:
+            boards = B.placement_batch(batch)
+            trace_start = time.perf_counter()
+            solved = np.flatnonzero(L.batch_trajectory(boards, P.targets))
+        if stats is not None:
+            stats.record(build_start, trace_start, len(batch))
+        if len(solved):
+            if stats is not None:
+                stats.finish()
+            return _solved(B, P, batch[solved[0]], batches, count, stats)
+    if stats is not None:
+        stats.finish()
+    return Solution(None, None, batches, count, None, stats)
 
-if __name__ == '__main__':
-    # Can test whichever of the test cases that needs to be tested
-    final_solution_generator('mad_1.bff', 500000)
-    #final_solution_generator('mad_4.bff', 500000)
-    #final_solution_generator('mad_7.bff', 500000)
-    #final_solution_generator('dark_1.bff', 500000)
-    #final_solution_generator('numbered_6.bff', 500000)
-    #final_solution_generator('showstopper_4.bff', 500000)
-    #final_solution_generator('tiny_5.bff', 500000)
-    #final_solution_generator('yarn_5.bff', 500000)
 
+# State of a parallel worker process, filled in once by _init_worker so the puzzle is not sent along with every shard
+_worker_state = {}
+
+
+def _init_worker(P, stop):
+    _worker_state['puzzle'] = P
+    B = Board(P.grid, P.laser_start, P.laser_path, P.targets)
+    _worker_state['board'] = B
+    _worker_state['laser'] = _cached_laser(B, P)
+    _worker_state['stop'] = stop
+
+
+def _solve_shard(prefix):
+    P = _worker_state['puzzle']
+    B = _worker_state['board']
+    L = _worker_state['laser']
+    stop = _worker_state['stop']
+    count = 0
+    for placement in B.canonical_placements(P.sample_space, P.inventory(), prefix):
+        # Checking the shared flag every so often lets the other workers give up once someone has found a solution
+        if count % 256 == 0 and stop.is_set():
+            return None, count
+        count += 1
+        if L.target_trajectory(B.mesh_overlay(placement), B.stride, B.target_bits, B.all_targets) == B.all_targets:
+            return placement, count
+    return None, count
+
+
+def parallel_solution_generator(puzzle, workers, stats=None, shards_per_worker=4):
+
+    '''
+    The parallel solution generator runs the exhaustive search across a pool of processes. The layouts are split into
+    disjoint shards by their first few decisions (see Board.canonical_prefixes), taking one more decision at a time until
+    there are several shards for every worker (or every shard is a single layout), so no worker runs out of shards while
+    the others are still busy. Every worker receives the parsed puzzle a single time when it starts, and the first
+    worker to find a solution tells the others to stop.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        workers: *int*
+            The number of worker processes to use.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+        shards_per_worker: *int*
+            The number of shards to split the layouts into for every worker, at least.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator, with the number of shards searched as the iterations. The stats only
+            count candidates and time as the shards come back, since the tracing happens in the worker processes.
+    '''
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    depth = 1
+    shards = list(B.canonical_prefixes(P.sample_space, P.inventory(), depth))
+    while len(shards) < shards_per_worker * workers:
+        depth += 1
+        deeper = list(B.canonical_prefixes(P.sample_space, P.inventory(), depth))
+        # The same shards one decision deeper means the beams of every shard are settled, and none can be split further
+        if deeper == shards:
+            break
+        shards = deeper
+    if stats is not None:
+        stats.begin('exhaustive', B.layout_count(P.sample_space, P.inventory()), None, bound=True)
+
+    context = multiprocessing.get_context()
+    stop = context.Event()
+    solution = None
+    searched = 0
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=_init_worker, initargs=(P, stop)) as pool:
+        futures = [pool.submit(_solve_shard, prefix) for prefix in shards]
+        for future in concurrent.futures.as_completed(futures):
+            solution, shard_count = future.result()
+            searched += 1
+            count += shard_count
+            if stats is not None:
+                now = time.perf_counter()
+                stats.record(now, now, shard_count)
+            if solution is not None:
+                stop.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+
+    if stats is not None:
+        stats.finish()
+    if solution is not None:
+        return _solved(B, P, solution, searched, count, stats)
+    return Solution(None, None, searched, count, None, stats)
+
+
+def backtracking_solution_generator(puzzle, stats=None):
+
+    '''
+    The backtracking solution generator places blocks one at a time along the current laser paths. Every open spot starts
+    undecided and is only decided (as A, B, C or left empty) once a beam runs into it, since spots no beam touches cannot
+    change the result. A branch is dropped as soon as the beams cannot reach an undecided spot anymore while targets are
+    still missing, when there are fewer undecided spots than blocks left to place, or when Board.mesh_reach shows that
+    no way of placing the blocks left could get a beam to every missing target.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator, with the number of search steps as the iterations.
+    '''
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    L = Laser(P.laser_start, P.laser_path)
+    if stats is not None:
+        stats.begin('backtrack', None, L)
+
+    # All the open spots start out undecided on the compact mesh
+    mesh = B.mesh_overlay([(spot, '?') for spot in P.sample_space])
+    spots = [B.cell_index(i, j) for i, j in P.sample_space]
+    block_counts = P.inventory()
+    counts = {'iterations': 0, 'candidates': 0}
+
+    def search(undecided):
+        counts['iterations'] += 1
+        counts['candidates'] += 1
+        if stats is not None:
+            trace_start = time.perf_counter()
+        hits, frontier, mask = L.partial_trajectory(mesh, B.stride, B.target_bits)
+        if stats is not None:
+            stats.record(trace_start, trace_start)
+        if not frontier:
+            # Nothing undecided is touched by a beam anymore, so the remaining blocks can only go in spots no beam
+            # reaches and the outcome is already fixed
+            return mask == B.all_targets and sum(block_counts.values()) <= undecided
+        if sum(block_counts.values()) == 0:
+            # Without blocks left every undecided spot stays empty, which only needs one last check
+            empty = [index for index in spots if mesh[index] == UNDECIDED]
+            for index in empty:
+                mesh[index] = EMPTY
+            counts['candidates'] += 1
+            if stats is not None:
+                trace_start = time.perf_counter()
+            mask = L.partial_trajectory(mesh, B.stride, B.target_bits)[2]
+            if stats is not None:
+                stats.record(trace_start, trace_start)
+            if mask == B.all_targets:
+                return True
+            for index in empty:
+                mesh[index] = UNDECIDED
+            return False
+
+        # Whatever the blocks left do in the undecided spots, some target may be out of reach of every beam
+        if mask != B.all_targets:
+            if B.mesh_reach(mesh, block_counts['A'] + block_counts['C'] > 0)[1] != B.all_targets:
+                return False
+
+        # Branching on the first undecided spot a beam reached: try every block we still have, then leaving it empty
+        index = frontier[0]
+        for block_type in ['A', 'B', 'C', 'o']:
+            if block_type != 'o' and block_counts[block_type] == 0:
+                continue
+            if block_type == 'o' and sum(block_counts.values()) > undecided - 1:
+                continue
+            mesh[index] = BLOCK_CODES[block_type]
+            if block_type != 'o':
+                block_counts[block_type] -= 1
+            if search(undecided - 1):
+                return True
+            if block_type != 'o':
+                block_counts[block_type] += 1
+        mesh[index] = UNDECIDED
+        return False
+
+    solved = search(len(P.sample_space))
+    if stats is not None:
+        stats.finish()
+    if solved:
+        # Any blocks left over go into spots that no beam reaches
+        placement = []
+        for spot, index in zip(P.sample_space, spots):
+            block = 'oABC'[mesh[index]] if mesh[index] != UNDECIDED else 'o'
+            if mesh[index] == UNDECIDED:
+                for block_type in ['A', 'B', 'C']:
+                    if block_counts[block_type] > 0:
+                        block = block_type
+                        block_counts[block_type] -= 1
+                        break
+            placement.append((spot, block))
+        return _solved(B, P, placement, counts['iterations'], counts['candidates'], stats)
+    return Solution(None, None, counts['iterations'], counts['candidates'], None, stats)
+
+
+def annealing_solution_generator(puzzle, maxiter=500000, time_budget=None, seed=None, stats=None,
+                                 temperature=1.0, cooling=0.99, patience=500):
+
+    '''
+    The annealing solution generator is a local search for boards too big to search exhaustively. It starts from a random
+    layout and keeps trying small changes, moving a block to an empty spot or swapping two blocks of different types,
+    scoring every layout by how many targets it hits. A change that hits as many targets or more is always kept, and one
+    that hits fewer is kept with a chance of exp(-lost targets / temperature), so the search can climb out of near
+    misses early on and settles down as the temperature cools. When a run has gone patience changes without beating its
+    best score it restarts from a new random layout. Changes are applied to a BoardState, so only the lasers that ran
+    into a changed spot are traced again.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        maxiter: *int*
+            The most changes tried before giving up.
+        time_budget: *float*
+            Seconds to search for before giving up, or None for no limit besides maxiter.
+        seed: *int*
+            Seed of the random number generator, for repeatable runs.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+        temperature: *float*
+            The temperature every run starts at.
+        cooling: *float*
+            The factor the temperature is multiplied by after every change.
+        patience: *int*
+            The number of changes without a new best score of the run before restarting.
+    **Returns**
+        solution: *Solution*
+            The same as final_solution_generator, with the number of changes tried as the iterations.
+    '''
+    rng = random.Random(seed)
+    P, B = _load(puzzle, stats)
+    if B.impossible_targets(P.sample_space):
+        return _no_solution(stats)
+    L = _fixed_laser(B, P)
+    if stats is not None:
+        stats.begin('anneal', maxiter, L)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    n_targets = len(B.target_list)
+    state = None
+    count = 0
+    for i in range(maxiter):
+        # The clock is only read every so often, it costs about as much as a change
+        if deadline is not None and i % 256 == 0 and time.perf_counter() > deadline:
+            break
+        if stats is not None:
+            trace_start = time.perf_counter()
+
+        if state is None or stale >= patience:
+            state = BoardState(B, L, B.sample_placement(P.sample_space, P.inventory(), rng))
+            score = best = state.mask().bit_count()
+            heat = temperature
+            stale = 0
+        else:
+            # Swapping two blocks of different types half the time (or whenever there is no empty spot), else moving one
+            spots = list(state.placement)
+            if not spots:
+                # With nothing in the inventory there is only the one layout
+                break
+            first = rng.choice(spots)
+            others = [spot for spot in spots if state.placement[spot] != state.placement[first]]
+            empty = [spot for spot in P.sample_space if spot not in state.placement]
+            if others and (not empty or rng.random() < 0.5):
+                second = rng.choice(others)
+                state.swap(first, second)
+                undo = (state.swap, first, second)
+            elif empty:
+                second = rng.choice(empty)
+                state.move(first, second)
+                undo = (state.move, second, first)
+            else:
+                # Every spot holds a block of the same type, so there is only the one layout
+                break
+
+            new_score = state.mask().bit_count()
+            if new_score >= score or rng.random() < math.exp((new_score - score) / heat):
+                score = new_score
+            else:
+                undo[0](undo[1], undo[2])
+            heat *= cooling
+            if score > best:
+                best = score
+                stale = 0
+            else:
+                stale += 1
+
+        count += 1
+        if stats is not None:
+            stats.record(trace_start, trace_start)
+        if score == n_targets:
+            if stats is not None:
+                stats.finish()
+            return _solved(B, P, list(state.placement.items()), count, count, stats)
+    if stats is not None:
+        stats.finish()
+    return Solution(None, None, count, count, None, stats)
+
+
+def solution_generator(puzzle, limit=None, equivalent=True, stats=None):
+
+    '''
+    The solution generator lists every solution of a puzzle, yielding each one as soon as it is found, which is what we
+    need to check that a level has exactly one. It walks the layouts of Board.canonical_search in a fixed order and
+    traces one layout of every set the lasers cannot tell apart. When that layout solves the puzzle, so does every
+    other way of putting the left over blocks on the spots no beam reaches, and those are yielded right after it. The
+    sets never overlap, so no layout is yielded twice, and nothing is kept from one layout to the next.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file that will we are trying to find a solution for.
+        limit: *int*
+            The most solutions to yield, or None for all of them.
+        equivalent: *bool*
+            Whether to also yield the layouts that only differ from a solution in spots no beam reaches. With False only
+            one solution of every such set is yielded.
+        stats: *SolverStats*
+            Optional stats the solver fills in while it runs, and reports progress through.
+    **Yields**
+        solution: *Solution*
+            A solution, with the layouts traced so far as both the iterations and the candidates.
+    '''
+    P, B = _load(puzzle, stats)
+    if limit == 0 or B.impossible_targets(P.sample_space):
+        if stats is not None:
+            stats.finish()
+        return
+    L = _fixed_laser(B, P)
+    if stats is not None:
+        stats.begin('all', B.layout_count(P.sample_space, P.inventory()), L, bound=True)
+    count = 0
+    found = 0
+    for decided, spare, left in B.canonical_search(P.sample_space, P.inventory(), (), None):
+        count += 1
+        if stats is not None:
+            build_start = time.perf_counter()
+        types = ['A'] * left['A'] + ['B'] * left['B'] + ['C'] * left['C']
+        mesh = B.mesh_overlay(decided + list(zip(spare, types)))
+        if stats is not None:
+            trace_start = time.perf_counter()
+        mask = L.target_trajectory(mesh, B.stride, B.target_bits, B.all_targets)
+        if stats is not None:
+            stats.record(build_start, trace_start)
+        if mask != B.all_targets:
+            continue
+
+        # The lasers go the same way for every spread of the left over blocks, so they are only traced once
+        first = _solved(B, P, decided + list(zip(spare, types)), count, count, stats)
+        rests = B.placements(spare, left) if equivalent else [list(zip(spare, types))]
+        for rest in rests:
+            placement = decided + rest
+            yield first._replace(grid=B.overlay(P.grid, placement), placement=tuple(sorted(placement)))
+            found += 1
+            if limit is not None and found >= limit:
+                if stats is not None:
+                    stats.finish()
+                return
+    if stats is not None:
+        stats.finish()
+
+
+class SolverTimeout(Exception):
+
+    '''
+    Raised inside a batch worker when a puzzle runs out of its time budget.
+    '''
+
+
+def _raise_timeout(signum, frame):
+    raise SolverTimeout()
+
+
+def _init_service_worker(stops):
+    _worker_state['stops'] = stops
+
+
+def _check_stop(signum, frame):
+    # Called every STOP_INTERVAL seconds while a service worker solves, to give up once the service has asked it to or
+    # the solve has run out of time
+    if _worker_state['stops'][_worker_state['slot']] or time.perf_counter() > _worker_state['end']:
+        raise SolverTimeout()
+
+
+def _solve_report(task):
+    # Solving a single puzzle in a batch worker and describing the outcome as a plain dictionary for the report
+    puzzle, mode, maxiter, timeout, collect_stats, store_path, slot = task
+    name = puzzle
+    if isinstance(puzzle, CatalogueEntry):
+        # A puzzle in a catalogue is sent as the catalogue and its number, and read here from the mapped file
+        catalogue = Catalogue(puzzle.path)
+        name = os.path.join(puzzle.path, catalogue.name(puzzle.index))
+        puzzle = catalogue[puzzle.index]
+        catalogue.close()
+    report = {'puzzle': name, 'mode': mode, 'status': None, 'solution': None, 'iterations': None,
+              'candidates': None, 'wall_time': None, 'peak_memory_kb': None}
+    stats = SolverStats() if collect_stats else None
+    store = SolutionStore(store_path) if store_path is not None else None
+    start = time.perf_counter()
+    use_alarm = (timeout is not None or slot is not None) and hasattr(signal, 'SIGALRM')
+    if use_alarm and slot is None:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    elif use_alarm:
+        # A solve of the solver service has a slot in the shared stop flags, which the alarm checks every so often
+        _worker_state['slot'] = slot
+        _worker_state['end'] = start + timeout if timeout is not None else math.inf
+        signal.signal(signal.SIGALRM, _check_stop)
+        signal.setitimer(signal.ITIMER_REAL, STOP_INTERVAL, STOP_INTERVAL)
+    try:
+        result = final_solution_generator(puzzle, maxiter, mode, output=None, stats=stats, store=store)
+        report['status'] = 'solved' if result.solved else 'unsolved'
+        report['solution'] = [' '.join(row) for row in result.grid] if result.solved else None
+        report['iterations'] = result.iterations
+        report['candidates'] = result.candidates
+    except SolverTimeout:
+        report['status'] = 'timeout'
+    except Exception as error:
+        report['status'] = 'error'
+        report['error'] = '{}: {}'.format(type(error).__name__, error)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if store is not None:
+            store.close()
+    report['wall_time'] = time.perf_counter() - start
+    if stats is not None:
+        report['stats'] = stats.as_dict()
+    if resource is not None:
+        # Each worker process only ever solves one puzzle, so its peak resident size belongs to this puzzle
+        report['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def puzzle_files(paths):
+
+    '''
+    The puzzle files function expands a list of .bff files and directories into the sorted .bff files they name.
+    **Parameters**
+        paths: *list,str*
+            Paths of .bff files or of directories holding .bff files.
+    **Returns**
+        files: *list,str*
+            The .bff files.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.bff'))
+        else:
+            files.append(path)
+    return files
+
+
+def batch_solve(paths, mode='backtrack', maxiter=500000, timeout=120, processes=None, stats=False, store=None):
+
+    '''
+    The batch solve function solves many puzzles at once across a pool of processes. Every puzzle gets a fresh worker
+    process, so a puzzle that runs past its timeout can be stopped without touching the others and the peak memory of
+    each worker belongs to a single puzzle. Nothing is written to solution.bff. Every puzzle of a catalogue is solved,
+    with each worker reading its own puzzle from the catalogue instead of being sent it.
+    **Parameters**
+        paths: *list,str*
+            Paths of .bff files, catalogues from compile_catalogue or directories holding .bff files.
+        mode: *str*
+            The solver mode, as for final_solution_generator.
+        maxiter: *int*
+            The iteration limit of the random mode.
+        timeout: *float*
+            Seconds each puzzle may take, or None for no limit.
+        processes: *int*
+            Number of worker processes, by default one per core.
+        stats: *bool*
+            Whether to add the SolverStats of every puzzle (as SolverStats.as_dict) to its entry.
+        store: *str*
+            Path of a SolutionStore file shared by the workers, or None.
+    **Returns**
+        report: *list,dict*
+            One entry per puzzle with its status ('solved', 'unsolved', 'timeout' or 'error'), solution grid, iterations,
+            candidates evaluated, wall time in seconds and peak memory in kilobytes.
+    '''
+    puzzles = []
+    for path in puzzle_files(paths):
+        if path.endswith(CATALOGUE_EXTENSION):
+            catalogue = Catalogue(path)
+            puzzles += [CatalogueEntry(path, index) for index in range(len(catalogue))]
+            catalogue.close()
+        else:
+            puzzles.append(path)
+    tasks = [(puzzle, mode, maxiter, timeout, stats, store, None) for puzzle in puzzles]
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        return pool.map(_solve_report, tasks, chunksize=1)
+
+
+class SolverService:
+
+    '''
+    The solver service keeps a pool of solver processes running, so a request costs neither starting Python nor
+    importing this module. Puzzles are sent as .bff text and parsed once here to find their Puzzle.key, and requests for
+    a puzzle that is already being solved (with the same mode) wait for that solve instead of starting another. Every
+    request has its own deadline, and a request that is dropped is no longer waited for. Once nobody waits for a solve
+    any more it is taken off the queue, or stopped by its worker within STOP_INTERVAL seconds if it has started, so
+    abandoned requests do not keep the workers busy until the timeout of the service.
+    '''
+
+    def __init__(self, workers=None, mode='backtrack', maxiter=500000, timeout=120, store=None):
+
+        '''
+        This function starts the worker processes.
+        **Parameters**
+            workers: *int*
+                Number of worker processes, by default one per core.
+            mode: *str*
+                The solver mode used when a request does not name one.
+            maxiter: *int*
+                The iteration limit of the random and anneal modes.
+            timeout: *float*
+                Seconds any single solve may take, and the deadline of requests that do not give one.
+            store: *str*
+                Path of a SolutionStore file the workers share, or None.
+        '''
+        self.mode = mode
+        self.maxiter = maxiter
+        self.timeout = timeout
+        self.store = store
+        # Every solve that is queued or running has a slot in the stop flags the workers share, which is set to ask the
+        # worker running it to give up
+        context = multiprocessing.get_context()
+        self.stops = context.RawArray('b', STOP_SLOTS)
+        self.free_slots = list(range(STOP_SLOTS))
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                           initializer=_init_service_worker, initargs=(self.stops,))
+        self.inflight = {}
+        self.solved = 0
+        self.coalesced = 0
+
+        # Starting every worker up front so the first requests do not pay for it
+        for future in [self.pool.submit(os.getpid) for _ in range(workers or os.cpu_count())]:
+            future.result()
+
+    async def solve(self, puzzle, mode=None, deadline=None):
+
+        '''
+        This function solves one puzzle for a request.
+        **Parameters**
+            puzzle: *str or Puzzle*
+                The puzzle in the .bff format, or already parsed.
+            mode: *str*
+                The solver mode, by default the one of the service.
+            deadline: *float*
+                Seconds to wait for the solution, by default the timeout of the service.
+        **Returns**
+            report: *dict*
+                The same entry batch_solve gives for a puzzle, with the Puzzle.key as the puzzle, whether the request
+                shared the solve of an earlier one, and 'timeout' as the status when the deadline passed first.
+        '''
+        mode = self.mode if mode is None else mode
+        deadline = self.timeout if deadline is None else deadline
+        P = puzzle if isinstance(puzzle, Puzzle) else Puzzle.from_text(puzzle)
+        key = (P.key(), mode)
+
+        entry = self.inflight.get(key)
+        coalesced = entry is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            slot = self.free_slots.pop() if self.free_slots else None
+            if slot is not None:
+                self.stops[slot] = 0
+            task = (P, mode, self.maxiter, self.timeout, False, self.store, slot)
+            future = self.pool.submit(_solve_report, task)
+            # The slot is only free again once the worker is done with it, which can be after the request gave up
+            if slot is not None:
+                future.add_done_callback(lambda done: self.free_slots.append(slot))
+            entry = [asyncio.wrap_future(future), 0, slot]
+            self.inflight[key] = entry
+            entry[0].add_done_callback(lambda done: self.inflight.pop(key, None))
+
+        # The solve is shared, so a request that gives up only stops waiting for it
+        entry[1] += 1
+        start = time.perf_counter()
+        try:
+            report = dict(await asyncio.wait_for(asyncio.shield(entry[0]), deadline))
+        except asyncio.TimeoutError:
+            report = {'status': 'timeout', 'solution': None, 'iterations': None, 'candidates': None}
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                # Cancelling only takes a solve off the queue, one that has started is stopped through its slot
+                entry[0].cancel()
+                if entry[2] is not None:
+                    self.stops[entry[2]] = 1
+        report.pop('peak_memory_kb', None)
+        report['puzzle'] = key[0]
+        report['mode'] = mode
+        report['coalesced'] = coalesced
+        report['wall_time'] = time.perf_counter() - start
+        self.solved += 1
+        return report
+
+    async def handle(self, reader, writer):
+
+        '''
+        This function answers one HTTP request: POST /solve with the puzzle as the body and optional mode and deadline
+        query parameters, answered with the report as JSON. The request stops waiting if the client hangs up first. A
+        request the service cannot read (or naming an unknown mode) gets a 400 and a failure while solving a 500, both
+        with the error as JSON.
+        **Parameters**
+            reader, writer: *asyncio.StreamReader, asyncio.StreamWriter*
+                The connection.
+        '''
+        status = None
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if len(request) < 2 or request[0] != 'POST' or urllib.parse.urlsplit(request[1]).path != '/solve':
+                status, answer = '404 Not Found', {'error': 'POST the puzzle to /solve'}
+            else:
+                query = urllib.parse.parse_qs(urllib.parse.urlsplit(request[1]).query)
+                mode = query.get('mode', [None])[0]
+                if mode is not None and mode not in SOLVER_MODES:
+                    raise ValueError('unknown solver mode {!r}'.format(mode))
+                deadline = float(query['deadline'][0]) if 'deadline' in query else None
+                P = Puzzle.from_text(body.decode())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except ValueError as error:
+            # Only what the client sent is checked here (the Content-Length, deadline and the puzzle itself), anything
+            # going wrong while solving is a fault of the server
+            status, answer = '400 Bad Request', {'error': '{}: {}'.format(type(error).__name__, error)}
+
+        if status is None:
+            solve = asyncio.ensure_future(self.solve(P, mode, deadline))
+            hangup = asyncio.ensure_future(reader.read(1))
+            await asyncio.wait([solve, hangup], return_when=asyncio.FIRST_COMPLETED)
+            if not solve.done():
+                solve.cancel()
+                writer.close()
+                return
+            hangup.cancel()
+            try:
+                status, answer = '200 OK', solve.result()
+            except Exception as error:
+                status, answer = '500 Internal Server Error', {'error': '{}: {}'.format(type(error).__name__, error)}
+            # The worker turns an exception of the solver into an 'error' report, which is still a failure of the server
+            if answer.get('status') == 'error':
+                status = '500 Internal Server Error'
+
+        content = json.dumps(answer).encode()
+        writer.write('HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(status, len(content)).encode() + content)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def _serve(service, host, port):
+    server = await asyncio.start_server(service.handle, host, port)
+    print('Solving puzzles POSTed to http://{}:{}/solve'.format(host, server.sockets[0].getsockname()[1]))
+    async with server:
+        await server.serve_forever()
+
+
+def serve(host='127.0.0.1', port=8765, **options):
+
+    '''
+    The serve function runs a SolverService as an HTTP server until it is interrupted, for example with
+        curl --data-binary @mad_1.bff 'http://127.0.0.1:8765/solve?mode=backtrack&deadline=5'
+    **Parameters**
+        host: *str*
+            The address to listen on, only this machine by default.
+        port: *int*
+            The port to listen on.
+        options:
+            Passed on to SolverService (workers, mode, maxiter, timeout and store).
+    '''
+    service = SolverService(**options)
+    try:
+        asyncio.run(_serve(service, host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+def random_level(rng, min_size=3, max_size=5, max_blocks=6, max_targets=4):
+
+    '''
+    The random level function makes up a puzzle the other way around from solving one. It draws a grid with some 'x'
+    spots and fixed blocks, an inventory and lasers, hides the inventory on the open spots, traces the lasers and picks
+    the targets from where they go. At least one target is somewhere only the hidden blocks send a laser, so the level
+    cannot be solved by keeping the blocks out of the way. The level is always solvable but may have other solutions.
+    **Parameters**
+        rng: *random.Random*
+            The random number generator to draw from.
+        min_size, max_size: *int*
+            The fewest and most rows and columns.
+        max_blocks: *int*
+            The most blocks in the inventory.
+        max_targets: *int*
+            The most targets.
+    **Returns**
+        puzzle: *Puzzle*
+            The level, or None if a block could not be hidden next to a beam or the hidden blocks did not send the
+            lasers anywhere new.
+        placement: *list,tuple*
+            The hidden ((i, j), block_type) placement that solves the level, or None.
+    '''
+    width = rng.randint(min_size, max_size)
+    height = rng.randint(min_size, max_size)
+    grid = [[rng.choices('oxABC', [80, 8, 6, 3, 3])[0] for _ in range(width)] for _ in range(height)]
+    B = Board(grid, [], [], [])
+    sample_space = B.sample_function(grid)
+    # At least two blocks go in the inventory and one open spot is left over
+    if len(sample_space) < 3:
+        return None, None
+
+    # Reflect blocks make for the most interesting levels, the other types are mixed in now and then
+    types = rng.choices('ABC', [6, 2, 2], k=rng.randint(2, min(max_blocks, len(sample_space) - 1)))
+    blocks = tuple((block_type, types.count(block_type)) for block_type in ['A', 'B', 'C'])
+
+    # Lasers start on the edge between two spots (one coordinate odd and the other even) and go diagonally, into the
+    # board when they start on its border
+    laser_start = []
+    laser_path = []
+    for _ in range(1 if rng.random() < 0.75 else 2):
+        x = rng.randint(0, 2 * width)
+        y = rng.randrange(1 - x % 2, 2 * height + 1, 2)
+        vx = 1 if x == 0 else -1 if x == 2 * width else rng.choice([-1, 1])
+        vy = 1 if y == 0 else -1 if y == 2 * height else rng.choice([-1, 1])
+        laser_start.append((x, y))
+        laser_path.append((vx, vy))
+
+    L = Laser(laser_start, laser_path)
+
+    def beams(placement):
+        intercepts, splits, intercept_new = L.trajectory(laser_path, grid, B.mesh_overlay(placement))
+        return set((index % B.stride - 1, index // B.stride - 1) for index in intercepts | intercept_new)
+
+    # Every block is hidden on a spot one of the beams passes (crossing the middle of one of its sides) with the blocks
+    # hidden so far, since a block no beam runs into could almost always be moved to another such spot and still solve
+    # the level, so there is no point checking a level with nowhere like that left for a block
+    empty = beams([])
+    reached = empty
+    placement = []
+    for block_type in types:
+        free = [spot for spot in sample_space if spot not in dict(placement)]
+        near = [(i, j) for i, j in free
+                if {(2 * i, 2 * j + 1), (2 * i + 2, 2 * j + 1), (2 * i + 1, 2 * j), (2 * i + 1, 2 * j + 2)} & reached]
+        if not near:
+            return None, None
+        placement.append((rng.choice(near), block_type))
+        reached = beams(placement)
+
+    # At least one target is somewhere the lasers only go with the hidden blocks in place
+    new = sorted(reached - empty - set(laser_start))
+    if not new:
+        return None, None
+
+    number = rng.randint(1, max_targets)
+    targets = rng.sample(new, min(len(new), number))
+    rest = sorted(reached - set(targets) - set(laser_start))
+    targets += rng.sample(rest, min(len(rest), number - len(targets)))
+    puzzle = Puzzle(tuple(tuple(row) for row in grid), tuple(laser_start), tuple(laser_path), frozenset(targets),
+                    blocks, tuple(sample_space))
+    return puzzle, placement
+
+
+def _generate_chunk(task):
+    # Drawing a number of random levels in a generator worker and keeping the ones with a single solution
+    seed, attempts, options = task
+    rng = random.Random(seed)
+    levels = []
+    rejected = {'trivial': 0, 'ambiguous': 0}
+    for _ in range(attempts):
+        P, placement = random_level(rng, **options)
+        if P is None:
+            rejected['trivial'] += 1
+        elif sum(1 for solution in solution_generator(P, limit=2)) != 1:
+            # Finding a second solution is all it takes to throw a level away, so the search stops there
+            rejected['ambiguous'] += 1
+        else:
+            levels.append(P)
+    return levels, rejected
+
+
+def generate_levels(count, workers=None, seed=0, chunk=50, **options):
+
+    '''
+    The generate levels function makes new levels with exactly one solution. Random levels from random_level are
+    drawn in chunks across a pool of processes, and every one is checked with solution_generator, which stops as soon
+    as it finds a second solution. Levels are built as Puzzle objects, so nothing is parsed along the way. Chunks are
+    collected in the order they were handed out, so the same seed gives the same levels with any number of workers.
+    **Parameters**
+        count: *int*
+            The number of levels to make.
+        workers: *int*
+            Number of worker processes, by default one per core.
+        seed: *int*
+            The random seed, every chunk draws from its own generator seeded from it.
+        chunk: *int*
+            The number of random levels each task draws.
+        options:
+            Passed on to random_level (min_size, max_size, max_blocks and max_targets).
+    **Returns**
+        levels: *list,Puzzle*
+            The levels, all different from each other.
+        report: *dict*
+            The number of levels and of random levels drawn, why the others were thrown away ('trivial' when the hidden
+            blocks changed nothing, 'ambiguous' with more than one solution, 'duplicate' when made before), the share
+            thrown away, the wall time in seconds, and levels per minute and random levels per second.
+    '''
+    start = time.perf_counter()
+    levels = []
+    keys = set()
+    attempts = 0
+    rejected = {'trivial': 0, 'ambiguous': 0, 'duplicate': 0}
+    tasks = (('{}-{}'.format(seed, index), chunk, options) for index in itertools.count())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keeping a couple of chunks per worker queued so no worker waits, without drawing far more than needed
+        pending = [pool.submit(_generate_chunk, next(tasks)) for _ in range(2 * (workers or os.cpu_count()))]
+        while len(levels) < count:
+            chunk_levels, chunk_rejected = pending.pop(0).result()
+            pending.append(pool.submit(_generate_chunk, next(tasks)))
+            attempts += chunk
+            for reason, number in chunk_rejected.items():
+                rejected[reason] += number
+            for P in chunk_levels:
+                key = P.key()
+                if key in keys:
+                    rejected['duplicate'] += 1
+                elif len(levels) < count:
+                    keys.add(key)
+                    levels.append(P)
+        for future in pending:
+            future.cancel()
+
+    wall_time = time.perf_counter() - start
+    report = {'levels': len(levels), 'attempts': attempts, 'rejected': rejected,
+              'rejection_rate': sum(rejected.values()) / attempts if attempts else None,
+              'wall_time': wall_time,
+              'levels_per_minute': 60 * len(levels) / wall_time if wall_time > 0 else None,
+              'attempts_per_second': attempts / wall_time if wall_time > 0 else None}
+    return levels, report
+
+
+def main(argv=None):
+
+    '''
+    The main function is the command line entry point. With a single puzzle it solves it and writes solution.bff like
+    before, and with several puzzles, a directory, a catalogue or --report it solves them all in parallel and writes a
+    JSON report.
+    **Parameters**
+        argv: *list,str*
+            The command line arguments, by default the ones the script was started with.
+    '''
+    parser = argparse.ArgumentParser(description='Solve Lazors puzzles from .bff files.')
+    parser.add_argument('paths', nargs='*', default=['mad_1.bff'], help='.bff files or directories of .bff files')
+    parser.add_argument('--mode', default='random', choices=SOLVER_MODES)
+    parser.add_argument('--maxiter', type=int, default=500000, help='iteration limit of the random and anneal modes')
+    parser.add_argument('--time-budget', type=float, default=None, help='seconds the anneal mode may search for')
+    parser.add_argument('--seed', type=int, default=None, help='random seed of the anneal mode and of --generate')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds each puzzle may take in a batch')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes for a batch')
+    parser.add_argument('--report', default=None, help='file to write the JSON report to (default: stdout)')
+    parser.add_argument('--progress', action='store_true',
+                        help='print progress while solving a single puzzle, and its stats once done, to stderr')
+    parser.add_argument('--stats', action='store_true', help='add the solver stats of every puzzle to the report')
+    parser.add_argument('--store', default=None, help='SQLite file to keep solutions in and look them up from')
+    parser.add_argument('--output', default='solution.bff', help="file to write a single solution to ('-' for stdout)")
+    parser.add_argument('--all', action='store_true', help='print every solution of a single puzzle and how many there are')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT',
+                        help='keep running and solve puzzles POSTed to /solve on this port')
+    parser.add_argument('--host', default='127.0.0.1', help='address the --serve server listens on')
+    parser.add_argument('--generate', type=int, default=None, metavar='COUNT',
+                        help='make this many new levels with exactly one solution')
+    parser.add_argument('--levels-dir', default='generated levels', help='directory --generate writes the levels to')
+    parser.add_argument('--compile', default=None, metavar='CATALOGUE',
+                        help='compile the puzzles into a catalogue file instead of solving them')
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        serve(args.host, args.serve, workers=args.processes, mode=args.mode, maxiter=args.maxiter,
+              timeout=args.timeout, store=args.store)
+        return
+
+    if args.generate is not None:
+        levels, report = generate_levels(args.generate, args.processes, 0 if args.seed is None else args.seed)
+        os.makedirs(args.levels_dir, exist_ok=True)
+        for number, level in enumerate(levels, 1):
+            with open(os.path.join(args.levels_dir, 'level_{:04d}.bff'.format(number)), 'w') as file:
+                file.write(level.text())
+        print(json.dumps(report, indent=2))
+        return
+
+    if args.compile is not None:
+        print('{} puzzles compiled into {}'.format(compile_catalogue(args.paths, args.compile), args.compile))
+        return
+
+    if (len(args.paths) == 1 and not os.path.isdir(args.paths[0]) and not args.paths[0].endswith(CATALOGUE_EXTENSION)
+            and args.report is None):
+        stats = SolverStats(print_progress) if args.progress else None
+        store = SolutionStore(args.store) if args.store is not None else None
+        if args.all:
+            count = 0
+            for solution in solution_generator(args.paths[0], stats=stats):
+                count += 1
+                print(solution.text())
+            print('{} solution{}'.format(count, '' if count == 1 else 's'))
+            return
+        output = sys.stdout if args.output == '-' else args.output
+        final_solution_generator(args.paths[0], args.maxiter, args.mode, output=output, stats=stats,
+                                 time_budget=args.time_budget, seed=args.seed, store=store)
+        if store is not None:
+            store.close()
+        if stats is not None:
+            print(json.dumps(stats.as_dict(), indent=2), file=sys.stderr)
+        return
+
+    report = batch_solve(args.paths, args.mode, args.maxiter, args.timeout, args.processes, args.stats, args.store)
+    if args.report is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
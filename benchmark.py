@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Benchmarks for the Lazor solver. Every solver mode is run on every puzzle in the bff files folder with fixed random seeds,
+and Game.database, Board.make_board and Laser.trajectory are timed on their own. The results can be saved as a baseline
+and later runs are compared against it, so that a slowdown (or a board going over the 2 minute limit from the README)
+makes the run fail instead of going unnoticed. A timing that comes out slower is measured again (twice by default) and
+only counts once it stays slow, as timings on a shared machine jump around from one run to the next.
+
+    python benchmark.py --save benchmark_baseline.json      # record a baseline
+    python benchmark.py --baseline benchmark_baseline.json  # compare against it, exits with 1 on a regression
+
+Timings only compare on the same machine, so no baseline is kept in the repository. Instead the benchmark workflow in
+.github/workflows runs this benchmark on the base commit of every pull request (and push to main) with --save and then
+on the change with --baseline, in the same job. The same can be done by hand:
+
+    git worktree add ../base main && cp benchmark.py ../base/
+    python ../base/benchmark.py --save /tmp/baseline.json
+    python benchmark.py --baseline /tmp/baseline.json
+
+Without a baseline only the 2 minute limit is checked.
+'''
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+import Lazor_solution as lazor
+
+
+PUZZLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bff files')
+MODES = ['random', 'exhaustive', 'backtrack', 'batch', 'anneal']
+
+# The README asks for every test board to be solved in under 2 minutes
+SLA_SECONDS = 120.0
+
+
+def bench_solver(puzzle, mode, seeds, maxiter, repeat=3):
+
+    '''
+    This function solves a puzzle with one solver mode, repeat times per seed keeping the fastest, and once more under
+    tracemalloc to see how much memory the solve allocates at its peak. The runs of a seed do the same work, so the
+    fastest of them is the one least disturbed by whatever else the machine was doing.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file to solve.
+        mode: *str*
+            The solver mode, as for final_solution_generator.
+        seeds: *list,int*
+            The random seeds, one run each.
+        maxiter: *int*
+            The iteration limit of the random mode.
+        repeat: *int*
+            How many times each seed is run.
+    **Returns**
+        result: *dict*
+            Times of every seed, their median, min and max, candidates evaluated for every seed and per second, whether
+            every run found a solution and the peak of traced allocations in bytes.
+    '''
+    times = []
+    candidates = []
+    solved = True
+    for seed in seeds:
+        runs = []
+        for _ in range(repeat):
+            random.seed(seed)
+            start = time.perf_counter()
+            result = lazor.final_solution_generator(puzzle, maxiter, mode, output=None, seed=seed)
+            runs.append(time.perf_counter() - start)
+        times.append(min(runs))
+        candidates.append(result.candidates)
+        solved = solved and result.solved
+
+    random.seed(seeds[0])
+    tracemalloc.start()
+    lazor.final_solution_generator(puzzle, maxiter, mode, output=None, seed=seeds[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'times': times,
+            'candidates': candidates,
+            'median': statistics.median(times),
+            'min': min(times),
+            'max': max(times),
+            'candidates_per_sec': sum(candidates) / sum(times) if sum(times) > 0 else None,
+            'solved': solved,
+            'peak_alloc_bytes': peak}
+
+
+def bench_components(puzzle, number):
+
+    '''
+    This function times the three building blocks every candidate used to go through, each on its own.
+    **Parameters**
+        puzzle: *str*
+            The puzzle file to use.
+        number: *int*
+            How many calls each timing averages over.
+    **Returns**
+        result: *dict*
+            Microseconds per call of Game.database, Board.make_board and Laser.trajectory.
+    '''
+    G = lazor.Game(puzzle)
+    P = lazor.Puzzle.from_file(puzzle)
+    B = lazor.Board(P.grid, P.laser_start, P.laser_path, P.targets)
+    L = lazor.Laser(P.laser_start, P.laser_path)
+    random.seed(0)
+    placement = B.sample_placement(P.sample_space, P.inventory())
+    grid = B.overlay(P.grid, placement)
+    mesh = B.mesh_overlay(placement)
+
+    result = {}
+    for name, function in [('Game.database', G.database),
+                           ('Board.make_board', lambda: B.make_board(grid)),
+                           ('Laser.trajectory', lambda: L.trajectory(P.laser_path, P.grid, mesh))]:
+        best = min(timeit.repeat(function, number=number, repeat=5))
+        result[name] = best / number * 1e6
+    return result
+
+
+def run(puzzles, modes, seeds, maxiter, number, repeat=3):
+
+    '''
+    This function runs the whole benchmark.
+    **Parameters**
+        puzzles: *list,str*
+            The puzzle files to use.
+        modes: *list,str*
+            The solver modes to run.
+        seeds: *list,int*
+            The random seeds, one run each.
+        maxiter: *int*
+            The iteration limit of the random mode.
+        number: *int*
+            How many calls each component timing averages over.
+        repeat: *int*
+            How many times each seed is run, keeping the fastest.
+    **Returns**
+        results: *dict*
+            The solver results by puzzle and mode, and the component timings by puzzle.
+    '''
+    results = {'solvers': {}, 'components': {}}
+    for puzzle in puzzles:
+        name = os.path.basename(puzzle)
+        results['solvers'][name] = {}
+        for mode in modes:
+            if mode == 'batch' and lazor.np is None:
+                continue
+            result = bench_solver(puzzle, mode, seeds, maxiter, repeat)
+            results['solvers'][name][mode] = result
+            print('{:<18} {:<11} median {:9.4f}s  max {:9.4f}s  {:>12} candidates/s  peak {:>9} B{}'.format(
+                name, mode, result['median'], result['max'],
+                '-' if result['candidates_per_sec'] is None else int(result['candidates_per_sec']),
+                result['peak_alloc_bytes'], '' if result['solved'] else '  (not solved)'))
+        results['components'][name] = bench_components(puzzle, number)
+        print('{:<18} '.format(name) + '  '.join('{} {:.1f}us'.format(key, value)
+                                                 for key, value in results['components'][name].items()))
+    return results
+
+
+def slow_timings(results, baseline, tolerance, floor, component_floor):
+
+    '''
+    This function finds the timings that got slower than a baseline by more than the tolerance and the floor.
+    **Parameters**
+        results, baseline, tolerance, floor, component_floor:
+            As for compare.
+    **Returns**
+        slow: *list,tuple*
+            A (puzzle name, mode or component name) pair for every slower timing.
+    '''
+    slow = []
+    for name, modes in results['solvers'].items():
+        for mode, result in modes.items():
+            old = baseline.get('solvers', {}).get(name, {}).get(mode)
+            if old is not None and result['median'] > old['median'] * (1 + tolerance) and \
+                    result['median'] - old['median'] > floor:
+                slow.append((name, mode))
+    for name, components in results['components'].items():
+        for key, value in components.items():
+            old = baseline.get('components', {}).get(name, {}).get(key)
+            if old is not None and value > old * (1 + tolerance) and value - old > component_floor:
+                slow.append((name, key))
+    return slow
+
+
+def remeasure(results, slow, puzzles, seeds, maxiter, number, repeat):
+
+    '''
+    This function times the slower timings found by slow_timings once more and keeps the faster of the two for each,
+    so that a timing only stays slow if it was not just disturbed by something else running on the machine.
+    **Parameters**
+        results: *dict*
+            The results of this run, updated in place.
+        slow: *list,tuple*
+            The (puzzle name, mode or component name) pairs to time again.
+        puzzles: *list,str*
+            The puzzle files of the run.
+        seeds, maxiter, number, repeat:
+            As for run.
+    '''
+    paths = {os.path.basename(puzzle): puzzle for puzzle in puzzles}
+    for name, key in slow:
+        if key in results['solvers'][name]:
+            result = results['solvers'][name][key]
+            again = bench_solver(paths[name], key, seeds, maxiter, repeat)
+            result['times'] = [min(old, new) for old, new in zip(result['times'], again['times'])]
+            result['median'] = statistics.median(result['times'])
+            result['min'] = min(result['times'])
+            result['max'] = max(result['times'])
+        else:
+            again = bench_components(paths[name], number)
+            results['components'][name][key] = min(results['components'][name][key], again[key])
+
+
+def compare(results, baseline, tolerance, floor, component_floor):
+
+    '''
+    This function compares a run against a baseline and lists everything that got worse.
+    **Parameters**
+        results: *dict*
+            The results of this run.
+        baseline: *dict*
+            The results of the baseline run.
+        tolerance: *float*
+            How much slower (as a fraction) a timing may get before it counts as a regression, and how many more
+            candidates a solver may evaluate.
+        floor: *float*
+            Solver timings differing by less than this many seconds are never a regression, to ignore timer noise.
+        component_floor: *float*
+            The same for the component timings, in microseconds per call.
+    **Returns**
+        problems: *list,str*
+            A description of every regression, and of every board over the 2 minute limit.
+    '''
+    problems = []
+    for name, modes in results['solvers'].items():
+        for mode, result in modes.items():
+            if result['max'] > SLA_SECONDS:
+                problems.append('{} {}: {:.1f}s is over the {:.0f}s limit'.format(name, mode, result['max'], SLA_SECONDS))
+            old = baseline.get('solvers', {}).get(name, {}).get(mode)
+            if old is None:
+                continue
+            if old['solved'] and not result['solved']:
+                problems.append('{} {}: no longer solved'.format(name, mode))
+            # The layouts traced for a seed do not depend on the machine, so more of them is a regression however noisy
+            # the timings are
+            if 'candidates' in old and sum(result['candidates']) > sum(old['candidates']) * (1 + tolerance):
+                problems.append('{} {}: {} candidates, baseline {}'.format(name, mode, sum(result['candidates']),
+                                                                         sum(old['candidates'])))
+    for name, key in slow_timings(results, baseline, tolerance, floor, component_floor):
+        if key in results['solvers'][name]:
+            problems.append('{} {}: median {:.4f}s, baseline {:.4f}s'.format(
+                name, key, results['solvers'][name][key]['median'], baseline['solvers'][name][key]['median']))
+        else:
+            problems.append('{} {}: {:.1f}us per call, baseline {:.1f}us'.format(
+                name, key, results['components'][name][key], baseline['components'][name][key]))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Lazor solver on the bundled puzzles.')
+    parser.add_argument('puzzles', nargs='*', default=[PUZZLE_DIR], help='.bff files or directories of .bff files')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--maxiter', type=int, default=500000, help='iteration limit of the random and anneal modes')
+    parser.add_argument('--number', type=int, default=200, help='calls per component timing')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per seed, the fastest is kept')
+    parser.add_argument('--baseline', default=None, help='baseline file to compare against')
+    parser.add_argument('--save', default=None, help='file to save this run to, for use as a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing (fraction)')
+    parser.add_argument('--floor', type=float, default=0.02, help='solver slowdowns under this many seconds are ignored')
+    parser.add_argument('--component-floor', type=float, default=3.0,
+                        help='component slowdowns under this many microseconds per call are ignored')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='times a slower timing is measured again before it counts as a regression')
+    args = parser.parse_args(argv)
+
+    puzzles = lazor.puzzle_files(args.puzzles)
+    results = run(puzzles, args.modes, args.seeds, args.maxiter, args.number, args.repeat)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    for _ in range(args.confirm):
+        slow = slow_timings(results, baseline, args.tolerance, args.floor, args.component_floor)
+        if not slow:
+            break
+        print('Timing again: ' + ', '.join('{} {}'.format(name, key) for name, key in slow))
+        remeasure(results, slow, puzzles, args.seeds, args.maxiter, args.number, args.repeat)
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    problems = compare(results, baseline, args.tolerance, args.floor, args.component_floor)
+    for problem in problems:
+        print('REGRESSION: ' + problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
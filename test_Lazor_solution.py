@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Tests for the Lazor solver, run with
+
+    python -m pytest -q
+'''
+
+import asyncio
+import json
+import os
+import random
+import sys
+
+import pytest
+
+import Lazor_solution as lazor
+
+PUZZLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bff files')
+
+# A small puzzle with every kind of line, one per line from GRID START on line 1 to the last target on line 10
+TINY = '''GRID START
+o B o
+o o o
+o o o
+GRID STOP
+A 3
+C 1
+L 4 5 -1 -1
+P 1 2
+P 6 3
+'''
+
+
+def puzzle_path(name):
+    return os.path.join(PUZZLES, name)
+
+
+@pytest.mark.parametrize('text, line, message', [
+    ('GRID START\nGRID STOP\nL 1 1 1 1\nP 1 1\n', 2, 'the grid has no rows'),
+    (TINY.replace('o B o', 'o q o'), 2, "unknown spot 'q'"),
+    (TINY.replace('o o o\nGRID STOP', 'o o\nGRID STOP'), 4, 'row of 2 spots in a grid of 3 columns'),
+    (TINY + 'GRID START\n', 11, 'a second grid'),
+    (TINY.replace('A 3', 'D 3'), 6, "unknown line 'D 3'"),
+    (TINY.replace('A 3', 'A three'), 6, 'A must be followed by whole numbers'),
+    (TINY.replace('A 3', 'A 3 1'), 6, 'A must be followed by a single count'),
+    (TINY.replace('A 3', 'A -3'), 6, 'A must be followed by a single count'),
+    (TINY.replace('C 1', 'A 1'), 7, 'a second count of A blocks'),
+    (TINY.replace('L 4 5 -1 -1', 'L 4 5 -1'), 8, 'L must be followed by x, y, vx and vy'),
+    (TINY.replace('L 4 5 -1 -1', 'L 4 5 2 -1'), 8, 'the direction of a laser must be 1 or -1'),
+    (TINY.replace('P 1 2', 'P 1'), 9, 'P must be followed by x and y'),
+    (TINY.replace('P 6 3', 'P 1 2'), 10, 'target 1 2 given twice'),
+    ('L 4 5 -1 -1\nP 1 2\n', 0, 'no GRID START'),
+    ('L 4 5 -1 -1\nP 1 2\nGRID START\no o\n', 3, 'GRID START without a GRID STOP'),
+    (TINY.replace('L 4 5 -1 -1', ''), 0, 'no lasers'),
+    (TINY.replace('P 1 2\nP 6 3', ''), 0, 'no targets'),
+    (TINY.replace('P 6 3', 'P 7 3'), 10, 'target at 7 3 is off the board'),
+])
+def test_parse_errors(text, line, message):
+    with pytest.raises(lazor.PuzzleFormatError) as error:
+        lazor.parse_bff(text, 'tiny.bff')
+    assert error.value.name == 'tiny.bff'
+    assert error.value.line == line
+    assert message in str(error.value)
+
+
+def test_parse_comments_and_blank_lines():
+    grid, laser_start, laser_path, targets, blocks = lazor.parse_bff('# a comment\n\n' + TINY.replace('A 3', 'A 3  # x'))
+    assert grid == [['o', 'B', 'o'], ['o', 'o', 'o'], ['o', 'o', 'o']]
+    assert laser_start == [(4, 5)] and laser_path == [(-1, -1)]
+    assert targets == [(1, 2), (6, 3)]
+    assert blocks == {'A': 3, 'B': 0, 'C': 1}
+
+
+def test_parse_rows_with_and_without_spaces():
+    spaceless = TINY.replace('o B o', 'oBo').replace('o o o', 'ooo')
+    assert lazor.parse_bff(spaceless) == lazor.parse_bff(TINY)
+    assert lazor.parse_bff(TINY.replace('o B o', 'o\tB  o')) == lazor.parse_bff(TINY)
+
+
+def test_catalogue_round_trip(tmp_path):
+    path = str(tmp_path / 'puzzles.lzc')
+    files = lazor.puzzle_files([PUZZLES])
+    assert lazor.compile_catalogue([PUZZLES], path) == len(files)
+    catalogue = lazor.Catalogue(path)
+    try:
+        assert len(catalogue) == len(files)
+        for index, file in enumerate(files):
+            assert catalogue[index] == lazor.Puzzle.from_file(file)
+            assert catalogue.name(index) == os.path.basename(file)
+    finally:
+        catalogue.close()
+
+
+def test_catalogue_rejects_counts_over_16_bits(tmp_path):
+    puzzle = tmp_path / 'big.bff'
+    puzzle.write_text(TINY.replace('A 3', 'A 70000'))
+    with pytest.raises(lazor.PuzzleFormatError) as error:
+        lazor.compile_catalogue([str(puzzle)], str(tmp_path / 'big.lzc'))
+    assert error.value.name == str(puzzle)
+    assert '65535 A blocks' in str(error.value)
+
+
+def test_solve_report_puzzle_and_catalogue_entry(tmp_path):
+    # A Puzzle is a tuple too, and must not be taken for a puzzle in a catalogue
+    P = lazor.Puzzle.from_file(puzzle_path('tiny_5.bff'))
+    report = lazor._solve_report((P, 'backtrack', 1000, None, False, None, None))
+    assert report['status'] == 'solved'
+
+    path = str(tmp_path / 'puzzles.lzc')
+    lazor.compile_catalogue([puzzle_path('tiny_5.bff')], path)
+    report = lazor._solve_report((lazor.CatalogueEntry(path, 0), 'backtrack', 1000, None, False, None, None))
+    assert report['status'] == 'solved'
+    assert report['puzzle'] == os.path.join(path, 'tiny_5.bff')
+
+
+def post(service, body, query=''):
+    # Sending one request to a SolverService over HTTP, the way a client would, and returning the status and answer
+    async def round_trip():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+            writer.write('POST /solve{} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(query, len(body)).encode() + body)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        return response
+
+    head, _, content = asyncio.run(round_trip()).partition(b'\r\n\r\n')
+    return head.split(b'\r\n')[0].decode(), json.loads(content)
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = lazor.SolverService(workers=1)
+    yield service
+    service.close()
+
+
+def test_service_round_trip(service):
+    with open(puzzle_path('tiny_5.bff'), 'rb') as file:
+        status, report = post(service, file.read())
+    assert status == 'HTTP/1.1 200 OK'
+    assert report['status'] == 'solved'
+
+
+def test_service_bad_puzzle(service):
+    status, answer = post(service, b'GRID START\n')
+    assert status == 'HTTP/1.1 400 Bad Request'
+    assert 'PuzzleFormatError' in answer['error']
+
+
+def test_batch_without_numpy(monkeypatch):
+    monkeypatch.setattr(lazor, 'np', None)
+    with pytest.raises(ImportError):
+        lazor.batch_solution_generator(puzzle_path('tiny_5.bff'))
+
+
+def test_parallel_shards_cover_every_layout():
+    # The shards of a parallel search together hold exactly the layouts of the exhaustive search
+    P = lazor.Puzzle.from_file(puzzle_path('mad_7.bff'))
+    B = lazor.Board(P.grid, P.laser_start, P.laser_path, P.targets)
+    layouts = sorted(map(sorted, B.canonical_placements(P.sample_space, P.inventory())))
+    for depth in [1, 3, 6]:
+        shards = list(B.canonical_prefixes(P.sample_space, P.inventory(), depth))
+        sharded = [sorted(placement) for prefix in shards
+                   for placement in B.canonical_placements(P.sample_space, P.inventory(), prefix)]
+        assert sorted(sharded) == layouts
+    assert lazor.parallel_solution_generator(P, 2).solved
+
+
+def test_solvers_agree_with_brute_force():
+    # Every solver that can prove a puzzle has no solution must agree with tracing every layout of the placements
+    # function, on small random levels and on the same levels with a target added that may make them unsolvable
+    rng = random.Random(7)
+    checked = unsolvable = 0
+    while checked < 200:
+        P, _ = lazor.random_level(rng, max_size=4, max_blocks=4)
+        if P is None:
+            continue
+        width, height = len(P.grid[0]), len(P.grid)
+        if checked % 2:
+            extra = (rng.randrange(1, 2 * width, 2), rng.randrange(0, 2 * height + 1, 2))
+            P = P._replace(targets=P.targets | {extra})
+        B = lazor.Board(P.grid, P.laser_start, P.laser_path, P.targets)
+        L = lazor.Laser(P.laser_start, P.laser_path)
+        expected = any(L.target_trajectory(B.mesh_overlay(placement), B.stride, B.target_bits, B.all_targets)
+                       == B.all_targets for placement in B.placements(P.sample_space, P.inventory()))
+        unsolvable += not expected
+        modes = ['exhaustive', 'backtrack'] + (['batch'] if lazor.np is not None else [])
+        for mode in modes:
+            assert lazor.final_solution_generator(P, mode=mode, output=None).solved == expected, (mode, P)
+        assert bool(list(lazor.solution_generator(P, limit=1))) == expected, P
+        checked += 1
+    # The added targets must have made some of the levels unsolvable, or the check proves little
+    assert unsolvable > 20
+
+
+def test_exhaustive_stats_give_a_bounded_eta():
+    stats = lazor.SolverStats()
+    lazor.final_solution_generator(puzzle_path('mad_7.bff'), mode='exhaustive', output=None, stats=stats)
+    assert stats.bound and stats.total >= stats.candidates
+    assert stats.eta is not None
+
+
+def test_solution_to_stdout_stays_clean(capsys):
+    result = lazor.final_solution_generator(puzzle_path('tiny_5.bff'), mode='backtrack', output=sys.stdout)
+    captured = capsys.readouterr()
+    assert captured.out == result.text()
+    assert 'Solution found!' in captured.err
+
+
+def test_service_unknown_mode(service):
+    with open(puzzle_path('tiny_5.bff'), 'rb') as file:
+        status, answer = post(service, file.read(), '?mode=bogus')
+    assert status == 'HTTP/1.1 400 Bad Request'
+    assert 'bogus' in answer['error']
+
+
+def test_service_solver_error(service, monkeypatch):
+    async def failing(self, puzzle, mode=None, deadline=None):
+        return {'status': 'error', 'error': 'RuntimeError: boom'}
+
+    monkeypatch.setattr(lazor.SolverService, 'solve', failing)
+    with open(puzzle_path('tiny_5.bff'), 'rb') as file:
+        status, answer = post(service, file.read())
+    assert status == 'HTTP/1.1 500 Internal Server Error'
+
+
+def test_service_stops_abandoned_solves():
+    # The random mode never gives up on a puzzle without a solution before maxiter, so the only worker stays busy
+    # unless the service stops the solve once its request has timed out
+    unsolvable = TINY.replace('A 3', 'A 1').replace('C 1', 'C 0')
+    assert not lazor.final_solution_generator(lazor.Puzzle.from_text(unsolvable), mode='exhaustive', output=None).solved
+    service = lazor.SolverService(workers=1, maxiter=10 ** 9, timeout=30)
+    try:
+        status, report = post(service, unsolvable.encode(), '?mode=random&deadline=0.2')
+        assert report['status'] == 'timeout'
+        with open(puzzle_path('tiny_5.bff'), 'rb') as file:
+            status, report = post(service, file.read(), '?deadline=10')
+        assert report['status'] == 'solved'
+    finally:
+        service.close()